@@ -0,0 +1,84 @@
+# WhatsFlow Activity
+# Per-hour and per-day message counts, rolled up as messages are written so the
+# dashboard chart and history reads touch a handful of rows instead of scanning
+# `messages`. Buckets are the stored timestamp truncated to the hour/day, which
+# is exactly the [start, end) range the old per-hour COUNT queries used.
+#
+#   python -m app.activity backfill    rebuild the rollup from messages
+from sqlalchemy import Column, Integer, String, event, func, select, text
+from sqlalchemy.dialects.sqlite import insert
+from app.db import Base, SessionLocal, Message, create_schema
+import datetime, sys
+
+SIZES = {"hour": ("%Y-%m-%d %H:00", datetime.timedelta(hours=1)),
+         "day":  ("%Y-%m-%d",       datetime.timedelta(days=1))}
+
+class Activity(Base):
+    __tablename__ = "activity"
+    size   = Column(String(4), primary_key=True)
+    bucket = Column(String(16), primary_key=True)
+    count  = Column(Integer, nullable=False, default=0)
+
+def floor(ts, size):
+    if size == "hour": return ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def key(ts, size):
+    return ts.strftime(SIZES[size][0])
+
+def bump(conn, timestamps, sign=1):
+    deltas = {}
+    for ts in timestamps:
+        for size in SIZES:
+            k = (size, key(ts, size))
+            deltas[k] = deltas.get(k, 0) + sign
+    rows = [{"size": s, "bucket": b, "count": n} for (s, b), n in deltas.items() if n]
+    if not rows: return
+    stmt = insert(Activity.__table__).values(rows)
+    conn.execute(stmt.on_conflict_do_update(index_elements=["size", "bucket"], set_={"count": Activity.__table__.c.count + stmt.excluded.count}))
+
+@event.listens_for(SessionLocal, "after_flush")
+def _track_flush(session, ctx):
+    added   = [m.timestamp for m in session.new if isinstance(m, Message)]
+    removed = [m.timestamp for m in session.deleted if isinstance(m, Message)]
+    if added: bump(session.connection(), added)
+    if removed: bump(session.connection(), removed, -1)
+
+def reset(db):
+    # For bulk deletes of every message (the dashboard "clear").
+    db.execute(Activity.__table__.delete())
+
+def series(db, start, end, size="hour"):
+    # Zero-filled counts for every bucket in [floor(start), end).
+    fmt, step = SIZES[size]
+    rows = dict(db.execute(select(Activity.bucket, Activity.count)
+                           .where(Activity.size == size, Activity.bucket >= key(start, size), Activity.bucket <= key(end, size))).all())
+    out, t = [], floor(start, size)
+    while t < end:
+        out.append({"bucket": t.isoformat(), "count": rows.get(t.strftime(fmt), 0)})
+        t += step
+    return out
+
+def backfill(db):
+    reset(db)
+    for size, (fmt, _) in SIZES.items():
+        db.execute(text(f"INSERT INTO activity (size, bucket, count) "
+                        f"SELECT :size, strftime('{fmt}', timestamp), count(*) FROM messages "
+                        f"WHERE timestamp IS NOT NULL GROUP BY 2"), {"size": size})
+
+def ensure_backfilled():
+    # Databases created before the rollup existed get filled once on startup.
+    db = SessionLocal()
+    try:
+        if db.scalar(select(Activity.size).limit(1)) is None and db.scalar(select(Message.id).limit(1)) is not None:
+            backfill(db); db.commit()
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["backfill"]: sys.exit("usage: python -m app.activity backfill")
+    create_schema()
+    db = SessionLocal()
+    backfill(db); db.commit()
+    print(db.scalar(select(func.sum(Activity.count)).where(Activity.size == "day")) or 0, "messages rolled up")
+    db.close()
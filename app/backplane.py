@@ -0,0 +1,120 @@
+# WhatsFlow Backplane
+# Carries broadcast events between every process serving /ws, so a message
+# written by one uvicorn worker (or container) reaches the dashboards held by
+# all of them. A backplane assigns each event its global seq and hands it to
+# `deliver(seq, event)` exactly once per process, in seq order, including the
+# publishing process itself; each process then fans out to its own sockets.
+#
+#   memory  single process (default)
+#   sqlite  shared change feed in the app database, polled by every worker;
+#           use with `uvicorn --workers N` or several containers on one volume
+#
+# Anything that can do "publish, then every subscriber sees it once, in order"
+# fits the same members (epoch and seq - the last seq seen - plus start,
+# publish and stop), e.g. a Redis stream with XADD/XREAD.
+from sqlalchemy import Column, DateTime, Integer, String, Text, func, insert, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from app.db import Base, SessionLocal, run_read, run_write
+import asyncio, datetime, json, logging, os, random, uuid
+
+log = logging.getLogger("whatsflow.backplane")
+
+class InProcessBackplane:
+    def __init__(self):
+        self.epoch   = uuid.uuid4().hex[:12]
+        self.seq     = 0
+        self.deliver = None
+
+    async def start(self, deliver):
+        self.deliver = deliver
+
+    async def publish(self, event):
+        self.seq += 1
+        if self.deliver: self.deliver(self.seq, event)
+
+    async def stop(self):
+        self.deliver = None
+
+class FeedEvent(Base):
+    __tablename__ = "event_feed"
+    __table_args__ = {"sqlite_autoincrement": True}  # ids are never reused after pruning
+    id      = Column(Integer, primary_key=True)
+    payload = Column(Text, nullable=False)
+    created = Column(DateTime, default=datetime.datetime.utcnow)
+
+class FeedState(Base):
+    # The feed's own settings, apart from the `stats` counters that clears reset.
+    __tablename__ = "event_feed_state"
+    name  = Column(String(20), primary_key=True)
+    value = Column(Integer, nullable=False)
+
+class SQLiteBackplane:
+    # The feed's ids are the global seq: SQLite serialises writers, so ids become
+    # visible in order and `id > seq` never skips or repeats a row.
+    def __init__(self, poll_ms=None, keep=None):
+        env = os.environ.get
+        self.poll    = (poll_ms or float(env("WHATSFLOW_BACKPLANE_POLL_MS", 50))) / 1000
+        self.keep    = keep or int(env("WHATSFLOW_BACKPLANE_KEEP", 10000))
+        self.epoch   = None
+        self.seq     = 0
+        self.deliver = None
+        self.task    = None
+
+    async def start(self, deliver):
+        self.deliver = deliver
+        self.epoch, self.seq = await run_write(self._open)
+        self.task = asyncio.create_task(self._poll_loop())
+
+    def _open(self):
+        # The epoch belongs to the database, so every worker (and every restart)
+        # agrees on it and ?since= resumes work whichever worker a client hits.
+        db = SessionLocal()
+        try:
+            db.execute(sqlite_insert(FeedState.__table__).values(name="epoch", value=random.getrandbits(48)).on_conflict_do_nothing())
+            epoch = db.scalar(select(FeedState.value).where(FeedState.name == "epoch"))
+            last = db.scalar(select(func.max(FeedEvent.id))) or 0
+            db.commit()
+            return f"{epoch:x}", last
+        finally:
+            db.close()
+
+    async def publish(self, event):
+        await run_write(self._insert, json.dumps(event))
+
+    def _insert(self, payload):
+        db = SessionLocal()
+        try:
+            seq = db.execute(insert(FeedEvent.__table__).values(payload=payload).returning(FeedEvent.__table__.c.id)).scalar()
+            if seq % 100 == 0: db.execute(FeedEvent.__table__.delete().where(FeedEvent.id <= seq - self.keep))
+            db.commit()
+        finally:
+            db.close()
+
+    def _fetch(self, after):
+        db = SessionLocal()
+        try: return db.execute(select(FeedEvent.id, FeedEvent.payload).where(FeedEvent.id > after).order_by(FeedEvent.id).limit(1000)).all()
+        finally: db.close()
+
+    async def _poll_loop(self):
+        while True:
+            try: rows = await run_read(self._fetch, self.seq)
+            except Exception:
+                log.exception("backplane poll failed")
+                rows = []
+            for seq, payload in rows:
+                self.seq = seq
+                try: self.deliver(seq, json.loads(payload))
+                except Exception: log.exception("backplane delivery of event %d failed", seq)
+            if len(rows) < 1000: await asyncio.sleep(self.poll)
+
+    async def stop(self):
+        if self.task: self.task.cancel()
+        await asyncio.gather(*(t for t in [self.task] if t), return_exceptions=True)
+        self.task = self.deliver = None
+
+BACKPLANES = {"memory": InProcessBackplane, "sqlite": SQLiteBackplane}
+
+def from_env():
+    name = os.environ.get("WHATSFLOW_BACKPLANE", "memory")
+    if name not in BACKPLANES: raise ValueError(f"unknown backplane {name!r}, expected one of {sorted(BACKPLANES)}")
+    return BACKPLANES[name]()
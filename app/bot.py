@@ -1,2 +1,293 @@
-# WhatsFlow Bot Logic Placeholder
-# Will handle message processing
+# WhatsFlow Bot
+# Rule-based replies to inbound messages, off the request path: ingestion
+# hands messages to submit() (never blocks), a pool of workers matches them
+# against the rules, and replies are written back as Message(status="sent" or
+# "failed") in batches through the same group-commit writer as the webhook.
+#
+# Rules live in a JSON file (WHATSFLOW_BOT_RULES, default app/rules.json),
+# re-read whenever it changes. The first rule in file order that matches wins:
+#
+#   {"name": "order", "keywords": ["order", "where is it"],      word/phrase hits, any one
+#    "regex": "order\\s*#?(?P<order>\\d+)",                    and/or a pattern (case-insensitive)
+#    "when": {"order": "*"},                                    per-sender state it needs ("*": any value)
+#    "set": {"order": "{order}"},                               state to store after replying
+#    "reply": "Order #{order} is on its way"}                   template, or a list to pick from
+#
+# Templates see the sender, the text, the pattern's named groups and the
+# sender's state; "default" replies when nothing matches. Rules compile once:
+# keywords into a phrase table, and each regex under a literal it requires in
+# an Aho-Corasick automaton, so a message costs a few lookups, one scan and
+# only the regexes that can match, whether there are ten rules or ten
+# thousand. Per-sender state is kept for the WHATSFLOW_BOT_CONTEXTS most
+# recent conversations.
+#
+#   python -m app.bot [--rules path] "message" ...    show which rule answers
+from collections import OrderedDict
+from sqlalchemy.dialects.sqlite import insert
+from app.db import BASE_DIR, SessionLocal, Message
+from app import stats, activity, metrics, webhook
+import asyncio, datetime, json, logging, os, random, re, sys
+try: from re import _parser as sre  # Python 3.11+
+except ImportError:
+    try: import sre_parse as sre
+    except ImportError: sre = None  # private API gone: every regex rule is loose
+
+log = logging.getLogger("whatsflow.bot")
+
+REPEATS = tuple(getattr(sre, op) for op in ("MAX_REPEAT", "MIN_REPEAT", "POSSESSIVE_REPEAT") if hasattr(sre, op))
+
+BOT   = "Bot"
+TOKEN = re.compile(r"\w+|[^\w\s]")
+
+def tokens(text):
+    return TOKEN.findall(text.casefold())
+
+class Vars(dict):
+    # Unknown template fields are left as written instead of raising.
+    def __missing__(self, key): return "{" + key + "}"
+
+def render(template, values):
+    return template.format_map(values)
+
+def required(pattern, shortest=2):
+    # Lowercased literals at least one of which is in every match of `pattern`,
+    # or None if there is no such set (no literal runs of `shortest` chars).
+    # This reads the private regex parser, whose shape may change between
+    # Python versions, so any failure means None: the rule is merely slower.
+    try: return _required(sre.parse(pattern, re.IGNORECASE), shortest)
+    except Exception:
+        log.debug("no required literals for %r", pattern, exc_info=True)
+        return None
+
+def _required(parsed, shortest):
+    def walk(seq):
+        options, run = [], ""
+        for op, av in seq:
+            if op is sre.LITERAL: run += chr(av); continue
+            if run: options.append([run.lower()]); run = ""
+            sub = None
+            if op is sre.SUBPATTERN: sub = walk(av[-1])
+            elif op in REPEATS and av[0] >= 1: sub = walk(av[2])
+            elif op is sre.BRANCH:
+                subs = [walk(b) for b in av[1]]
+                if all(subs): sub = [lit for s in subs for lit in s]
+            if sub: options.append(sub)
+        if run: options.append([run.lower()])
+        options = [o for o in options if min(map(len, o)) >= shortest]
+        return max(options, key=lambda o: min(map(len, o)), default=None)
+    found = walk(parsed)
+    if found is not None and not all(isinstance(lit, str) and lit for lit in found): raise ValueError(f"bad literals {found!r}")
+    return found
+
+class Automaton:
+    # Aho-Corasick: one pass over the text finds every occurrence of every
+    # word, however many words there are. Values are the rule indexes.
+    def __init__(self, words):
+        self.goto, self.fail, self.out = [{}], [0], [()]
+        for word, values in words.items():
+            s = 0
+            for ch in word:
+                if ch not in self.goto[s]:
+                    self.goto[s][ch] = len(self.goto)
+                    self.goto.append({}); self.fail.append(0); self.out.append(())
+                s = self.goto[s][ch]
+            self.out[s] += tuple(values)
+        queue = list(self.goto[0].values())
+        for s in queue:
+            for ch, t in self.goto[s].items():
+                f = self.fail[s]
+                while f and ch not in self.goto[f]: f = self.fail[f]
+                self.fail[t] = self.goto[f].get(ch, 0)
+                self.out[t] += self.out[self.fail[t]]
+                queue.append(t)
+
+    def scan(self, text):
+        goto, fail, out = self.goto, self.fail, self.out
+        hits, s = set(), 0
+        for ch in text:
+            while s and ch not in goto[s]: s = fail[s]
+            s = goto[s].get(ch, 0)
+            if out[s]: hits.update(out[s])
+        return hits
+
+class Rule:
+    def __init__(self, index, spec):
+        self.index    = index
+        self.name     = spec.get("name") or f"rule {index}"
+        self.keywords = [tuple(tokens(k)) for k in spec.get("keywords", ())]
+        self.regex    = re.compile(spec["regex"], re.IGNORECASE) if spec.get("regex") else None
+        self.when     = tuple(sorted((spec.get("when") or {}).items()))
+        self.set      = spec.get("set") or {}
+        reply         = spec.get("reply")
+        self.replies  = [reply] if isinstance(reply, str) else list(reply or ())
+        if not (self.keywords or self.regex): raise ValueError(f"{self.name}: needs keywords or a regex")
+        if not self.replies: raise ValueError(f"{self.name}: needs a reply")
+
+    def applies(self, state):
+        return all((k in state) if v == "*" else state.get(k) == v for k, v in self.when)
+
+class Rules:
+    def __init__(self, spec):
+        self.rules   = [Rule(i, r) for i, r in enumerate(spec.get("rules", ()))]
+        d            = spec.get("default")
+        self.default = [d] if isinstance(d, str) else list(d or ())
+        # Phrase table: token tuple -> indexes of the rules listing it.
+        self.phrases = {}
+        for r in self.rules:
+            for k in r.keywords:
+                if k: self.phrases.setdefault(k, []).append(r.index)
+        self.longest = max(map(len, self.phrases), default=0)
+        # Regexes are indexed by a literal every match must contain, so only the
+        # few whose literal occurs in the message get run; the rest ("loose",
+        # e.g. "\\d{5}") are tried on every message.
+        literals, self.loose = {}, []
+        for r in self.rules:
+            if not r.regex: continue
+            found = required(r.regex.pattern)
+            if found:
+                for lit in found: literals.setdefault(lit, []).append(r.index)
+            else: self.loose.append(r.index)
+        self.literals = Automaton(literals)
+
+    def __len__(self): return len(self.rules)
+
+    def match(self, text, state):
+        # The earliest rule (file order) whose keywords or regex hit and whose
+        # "when" holds for this sender, or None.
+        best = len(self.rules)
+        words = tokens(text)
+        for i in range(len(words)):
+            for n in range(1, min(self.longest, len(words) - i) + 1):
+                for idx in self.phrases.get(tuple(words[i:i + n]), ()):
+                    if idx < best and self.rules[idx].applies(state): best = idx
+        for idx in sorted(self.literals.scan(text.lower()).union(self.loose)):
+            if idx >= best: break
+            r = self.rules[idx]
+            if r.applies(state) and r.regex.search(text): best = idx; break
+        return self.rules[best] if best < len(self.rules) else None
+
+    def reply(self, sender, text, state):
+        # (rule name or None, reply text or None); updates `state` in place.
+        rule = self.match(text, state)
+        values = Vars(state, sender=sender, text=text)
+        if rule is None:
+            return None, (render(random.choice(self.default), values) if self.default else None)
+        m = rule.regex.search(text) if rule.regex else None
+        if m: values.update({k: v for k, v in m.groupdict().items() if v is not None})
+        out = render(random.choice(rule.replies), values)
+        state.update({k: render(v, values) if isinstance(v, str) else v for k, v in rule.set.items()})
+        return rule.name, out
+
+def load(path):
+    with open(path, encoding="utf-8") as f: return Rules(json.load(f))
+
+class Contexts(OrderedDict):
+    # Per-sender rule state for the most recent conversations (LRU).
+    def __init__(self, size):
+        super().__init__()
+        self.size = size
+
+    def get_state(self, sender):
+        state = self.pop(sender, None)
+        self[sender] = state = {} if state is None else state
+        if len(self) > self.size: self.popitem(last=False)
+        return state
+
+def write_replies(rows):
+    # Same contract as webhook.write_batch, for bot-authored rows (no users).
+    db = SessionLocal()
+    try:
+        conn = db.connection()
+        ids = conn.execute(insert(Message.__table__).values(rows).returning(Message.__table__.c.id)).scalars().all()
+        stats.bump(conn, stats.message_deltas([r["status"] for r in rows]))
+        activity.bump(conn, [r["timestamp"] for r in rows])
+        db.commit()
+    finally:
+        db.close()
+    return [{**r, "id": i} for r, i in zip(rows, sorted(ids))], []
+
+class Bot:
+    def __init__(self, on_batch=None, path=None, workers=None, maxsize=None, contexts=None, reload_s=None, send=None):
+        # `send(phone, text)` delivers a reply (e.g. via the Cloud API); a reply
+        # whose send raises is stored as "failed". Without one, replies are
+        # only stored, as "sent".
+        env = os.environ.get
+        self.path     = path or env("WHATSFLOW_BOT_RULES", os.path.join(BASE_DIR, "rules.json"))
+        self.rules    = load(self.path)
+        self.mtime    = os.stat(self.path).st_mtime_ns
+        workers       = workers or int(env("WHATSFLOW_BOT_WORKERS", 4))
+        maxsize       = maxsize or int(env("WHATSFLOW_BOT_QUEUE", 10000))
+        self.queues   = [asyncio.Queue(max(1, maxsize // workers)) for _ in range(workers)]
+        self.contexts = Contexts(contexts or int(env("WHATSFLOW_BOT_CONTEXTS", 10000)))
+        self.reload   = reload_s if reload_s is not None else float(env("WHATSFLOW_BOT_RELOAD_S", 2))
+        self.send     = send
+        self.writer   = webhook.Ingestor(on_batch=on_batch, write=write_replies)
+        self.tasks    = []
+
+    def submit(self, messages):
+        # Never waits: a sender's messages always go to the same worker, so its
+        # replies (and state) stay in order; when that worker is backed up the
+        # message is stored without a reply.
+        for m in messages:
+            if m.get("status", "received") != "received" or m["sender"] == BOT: continue
+            try: self.queues[hash(m["sender"]) % len(self.queues)].put_nowait((m["sender"], m["text"]))
+            except asyncio.QueueFull:
+                metrics.bot_dropped.inc()
+                log.warning("bot queue full, not replying to %s", m["sender"])
+
+    def start(self):
+        self.writer.start()
+        self.tasks = [asyncio.create_task(self._work(q)) for q in self.queues]
+        if self.reload: self.tasks.append(asyncio.create_task(self._watch()))
+
+    async def stop(self):
+        # Answer what is already queued, then flush the writer.
+        for q in self.queues: await q.put(None)
+        workers, watch = self.tasks[:len(self.queues)], self.tasks[len(self.queues):]
+        for t in watch: t.cancel()
+        await asyncio.gather(*workers, *watch, return_exceptions=True)
+        self.tasks = []
+        await self.writer.stop()
+
+    async def _work(self, queue):
+        while (item := await queue.get()) is not None:
+            sender, text = item
+            try: rule, reply = self.rules.reply(sender, text, self.contexts.get_state(sender))
+            except Exception:
+                log.exception("bot rules failed on a message from %s", sender)
+                continue
+            if reply is None: continue
+            status = "sent"
+            if self.send:
+                try: await self.send(sender, reply)
+                except Exception:
+                    log.exception("sending reply to %s failed", sender)
+                    status = "failed"
+            metrics.bot_replies.inc(status)
+            if not await self.writer.submit([{"sender": BOT, "text": reply, "status": status, "timestamp": datetime.datetime.utcnow()}]):
+                log.warning("reply to %s dropped, writer queue full", sender)
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.reload)
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+                if mtime == self.mtime: continue
+                self.mtime = mtime
+                self.rules = await asyncio.to_thread(load, self.path)
+                log.info("reloaded %d bot rules from %s", len(self.rules), self.path)
+            except Exception:
+                log.exception("bot rules in %s not reloaded, keeping the previous ones", self.path)
+
+if __name__ == "__main__":
+    import argparse
+    p = argparse.ArgumentParser(prog="python -m app.bot")
+    p.add_argument("--rules", default=os.environ.get("WHATSFLOW_BOT_RULES", os.path.join(BASE_DIR, "rules.json")))
+    p.add_argument("--sender", default="+49 176 1234567")
+    p.add_argument("messages", nargs="*")
+    a = p.parse_args()
+    rules, state = load(a.rules), {}
+    print(f"{len(rules)} rules compiled from {a.rules}", file=sys.stderr)
+    for text in a.messages:
+        name, reply = rules.reply(a.sender, text, state)
+        print(f"{text!r} -> [{name or 'default'}] {reply}")
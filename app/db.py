@@ -0,0 +1,82 @@
+from sqlalchemy import create_engine, event, Column, Integer, String, DateTime, Text, Index
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import datetime, asyncio, contextvars, fcntl, functools, os
+
+# ── Database Setup ────────────────────────────────────────────────
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_PATH = os.environ.get("WHATSFLOW_DB", os.path.join(BASE_DIR, "whatsflow.db"))
+engine = create_engine(f"sqlite:///{DB_PATH}", connect_args={"check_same_thread": False})
+SessionLocal = sessionmaker(bind=engine)
+Base = declarative_base()
+
+# WAL lets readers run alongside the single writer; the rest trade a little
+# durability on power loss (never corruption) for far fewer fsyncs.
+PRAGMAS = {
+    "journal_mode": os.environ.get("WHATSFLOW_DB_JOURNAL", "WAL"),
+    "synchronous":  os.environ.get("WHATSFLOW_DB_SYNCHRONOUS", "NORMAL"),
+    "busy_timeout": int(os.environ.get("WHATSFLOW_DB_BUSY_TIMEOUT", 5000)),
+    "mmap_size":    int(os.environ.get("WHATSFLOW_DB_MMAP", 256 * 1024 * 1024)),
+    "cache_size":   int(os.environ.get("WHATSFLOW_DB_CACHE", -64 * 1024)),
+}
+
+@event.listens_for(engine, "connect")
+def _set_pragmas(dbapi_conn, record):
+    cur = dbapi_conn.cursor()
+    for name, value in PRAGMAS.items(): cur.execute(f"PRAGMA {name}={value}")
+    cur.close()
+
+class Message(Base):
+    __tablename__ = "messages"
+    id        = Column(Integer, primary_key=True, index=True)
+    sender    = Column(String(100), nullable=False)
+    text      = Column(Text, nullable=False)
+    status    = Column(String(20), default="received")
+    timestamp = Column(DateTime, default=datetime.datetime.utcnow)
+    __table_args__ = (Index("ix_messages_timestamp_id", "timestamp", "id"),)
+
+class User(Base):
+    __tablename__ = "users"
+    id            = Column(Integer, primary_key=True)
+    phone         = Column(String(50), unique=True, nullable=False)
+    first_seen    = Column(DateTime, default=datetime.datetime.utcnow)
+    last_seen     = Column(DateTime, default=datetime.datetime.utcnow)
+    message_count = Column(Integer, default=0)
+    __table_args__ = (Index("ix_users_last_seen_id", "last_seen", "id"),)
+
+def create_schema():
+    # create_all() skips tables that already exist, so add indexes introduced
+    # since an older database was created as well.
+    Base.metadata.create_all(bind=engine)
+    for table in Base.metadata.tables.values():
+        for ix in table.indexes: ix.create(engine, checkfirst=True)
+
+@contextmanager
+def startup_lock():
+    # Serialises schema setup and seeding across worker processes.
+    with open(DB_PATH + ".lock", "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try: yield
+        finally: fcntl.flock(f, fcntl.LOCK_UN)
+
+# ── Executors ─────────────────────────────────────────────────────
+# Sessions are synchronous, so async handlers hand their DB work to these pools
+# instead of blocking the event loop. Writes go through one thread (SQLite only
+# has one writer anyway, and this avoids busy-waiting on the write lock);
+# reads get a bounded pool of their own so they never queue behind writes.
+# The caller's context goes along, as with Starlette's threadpool, so
+# per-request accounting (app/metrics.py) sees the queries.
+_reader = ThreadPoolExecutor(int(os.environ.get("WHATSFLOW_DB_READERS", 4)), thread_name_prefix="db-read")
+_writer = ThreadPoolExecutor(1, thread_name_prefix="db-write")
+
+def _submit(pool, fn, args, kwargs):
+    ctx = contextvars.copy_context()
+    return asyncio.get_running_loop().run_in_executor(pool, ctx.run, functools.partial(fn, *args, **kwargs))
+
+async def run_read(fn, *args, **kwargs):
+    return await _submit(_reader, fn, args, kwargs)
+
+async def run_write(fn, *args, **kwargs):
+    return await _submit(_writer, fn, args, kwargs)
@@ -0,0 +1,93 @@
+# WhatsFlow Event Log
+# Sequenced delta protocol for /ws. Every published event gets a monotonic seq
+# and carries only what changed: new messages, the counters whose value moved
+# and the touched users. Recent events stay in a ring buffer so a reconnecting
+# dashboard (/ws?since=<epoch>.<seq>) is sent just the gap. Bursts are coalesced
+# into at most one frame every WHATSFLOW_WS_COALESCE_MS.
+#
+# Seqs and the epoch come from the backplane (app/backplane.py), so they mean
+# the same thing on every worker.
+#
+# Frames: {"type": "init", "epoch", "seq", ...snapshot}
+#         {"type": "update", "base", "seq", "messages", "stats", "users", "truncated"}
+# An update applies on top of state at seq == base; a client whose last seq is
+# below base has missed something and should reconnect with ?since=. An update
+# holding more than max_messages keeps the newest and says how many older ones
+# it left out in "truncated"; the client re-reads /api/messages for those.
+from collections import deque
+from app import metrics
+import asyncio, json, os, time, uuid
+
+class EventLog:
+    def __init__(self, publish, epoch=None, size=None, interval_ms=None, max_messages=None):
+        env = os.environ.get
+        self.publish      = publish
+        self.epoch        = epoch or uuid.uuid4().hex[:12]
+        self.seq          = 0
+        self.log          = deque(maxlen=size or int(env("WHATSFLOW_WS_REPLAY", 1024)))
+        self.interval     = (interval_ms if interval_ms is not None else float(env("WHATSFLOW_WS_COALESCE_MS", 100))) / 1000
+        self.max_messages = max_messages or int(env("WHATSFLOW_WS_MAX_MESSAGES", 100))
+        self.stats        = {}
+        self.pending      = []
+        self.last_flush   = 0.0
+        self.timer        = None
+
+    def append(self, event, seq=None):
+        # Take the backplane's seq (or the next local one), reduce stats to the
+        # changed counters, then flush now or once the coalescing window closes.
+        # An already-seen seq is dropped, so each event reaches a socket once.
+        seq = self.seq + 1 if seq is None else seq
+        if seq <= self.seq: return None
+        self.seq = seq
+        event = {**event, "seq": seq}
+        if event["type"] == "update" and "stats" in event:
+            full, event["stats"] = event["stats"], {k: v for k, v in event["stats"].items() if self.stats.get(k) != v}
+            self.stats.update(full)
+        elif "stats" in event:
+            self.stats = dict(event["stats"])
+        self.log.append(event)
+        self.pending.append(event)
+        if self.timer is None:
+            delay = self.last_flush + self.interval - time.monotonic()
+            self.timer = asyncio.get_running_loop().call_later(max(0, delay), self.flush)
+        return event
+
+    def flush(self):
+        self.timer, self.last_flush = None, time.monotonic()
+        pending, self.pending = self.pending, []
+        for frame in self.frames(pending):
+            with metrics.broadcast_seconds.time("encode"): data = json.dumps(frame)
+            self.publish(data)
+
+    def frames(self, events):
+        # A reset (init) supersedes everything before it; the rest merge into one update.
+        out = []
+        for i in range(len(events) - 1, -1, -1):
+            if events[i]["type"] == "init":
+                out.append({**events[i], "epoch": self.epoch})
+                events = events[i + 1:]
+                break
+        if events: out.append(self.merge(events))
+        return out
+
+    def merge(self, events):
+        frame = {"type": "update", "base": events[0]["seq"] - 1, "seq": events[-1]["seq"], "messages": [], "stats": {}}
+        users = {}
+        for e in events:
+            frame["messages"].extend(e.get("messages", ()))
+            frame["stats"].update(e.get("stats", {}))
+            for u in e.get("users", ()): users[u["phone"]] = u
+        dropped = len(frame["messages"]) - self.max_messages
+        if dropped > 0: frame["messages"], frame["truncated"] = frame["messages"][-self.max_messages:], dropped
+        if users: frame["users"] = list(users.values())
+        return frame
+
+    def since(self, cursor):
+        # Frames that bring a client at `cursor` up to date: [] if it already is,
+        # None if the gap is no longer (or never was) in the buffer.
+        try: epoch, seq = cursor.split("."); seq = int(seq)
+        except (AttributeError, ValueError): return None
+        if epoch != self.epoch or seq > self.seq: return None
+        if seq == self.seq: return []
+        if not self.log or self.log[0]["seq"] > seq + 1: return None
+        return self.frames([e for e in self.log if e["seq"] > seq])
@@ -0,0 +1,109 @@
+# WhatsFlow Broadcast Hub
+# Fans a payload out to every dashboard socket. Each payload is encoded once;
+# every client gets its own bounded outbound queue drained by its own sender
+# task, so a slow or stalled browser only ever delays itself.
+#
+# Slow-consumer policies, applied when a client's queue is full:
+#   drop_oldest  discard the oldest queued frame to make room
+#   coalesce     discard everything queued and keep only the newest frame
+#   disconnect   close the socket; the browser reconnects and gets a fresh init
+from collections import deque
+from starlette.websockets import WebSocketDisconnect
+from app import metrics
+import anyio, asyncio, json, logging, os
+
+log = logging.getLogger("whatsflow.hub")
+
+POLICIES = ("drop_oldest", "coalesce", "disconnect")
+PING     = json.dumps({"type": "ping"})
+
+class Client:
+    def __init__(self, ws, maxsize):
+        self.ws      = ws
+        self.queue   = deque()
+        self.maxsize = maxsize
+        self.wakeup  = asyncio.Event()
+        self.dropped = 0
+        self.closed  = False
+
+    def push(self, frame, policy):
+        # Returns False when the client should be disconnected.
+        if len(self.queue) >= self.maxsize:
+            if policy == "disconnect": return False
+            dropped = len(self.queue) if policy == "coalesce" else 1
+            if policy == "coalesce": self.queue.clear()
+            else: self.queue.popleft()
+            self.dropped += dropped
+            metrics.ws_dropped_frames.inc(by=dropped)
+        self.queue.append(frame)
+        self.wakeup.set()
+        return True
+
+class Hub:
+    def __init__(self, maxsize=64, policy="drop_oldest", send_timeout=10.0, heartbeat=30.0):
+        if policy not in POLICIES: raise ValueError(f"unknown slow-consumer policy {policy!r}, expected one of {POLICIES}")
+        self.clients      = set()
+        self.maxsize      = maxsize
+        self.policy       = policy
+        self.send_timeout = send_timeout
+        self.heartbeat    = heartbeat
+
+    @classmethod
+    def from_env(cls):
+        return cls(maxsize=int(os.environ.get("WHATSFLOW_WS_QUEUE", 64)),
+                   policy=os.environ.get("WHATSFLOW_WS_POLICY", "drop_oldest"),
+                   send_timeout=float(os.environ.get("WHATSFLOW_WS_SEND_TIMEOUT", 10)),
+                   heartbeat=float(os.environ.get("WHATSFLOW_WS_HEARTBEAT", 30)))
+
+    def __len__(self): return len(self.clients)
+
+    def publish(self, data):
+        # Never awaits: enqueue the one encoded frame everywhere and return.
+        frame = data if isinstance(data, str) else json.dumps(data)
+        with metrics.broadcast_seconds.time("fanout"):
+            for client in list(self.clients):
+                if not client.push(frame, self.policy): self._evict(client, "slow consumer")
+
+    def _evict(self, client, reason=None):
+        if client.closed: return
+        client.closed = True
+        self.clients.discard(client)
+        client.wakeup.set()
+        metrics.ws_evictions.inc(reason.split(" (")[0] if reason else "disconnected")
+        if reason: log.info("dropping websocket client: %s", reason)
+
+    async def serve(self, ws, *frames):
+        # Run one accepted socket until it disconnects, dies or is evicted.
+        # `frames` are queued ahead of anything published from here on.
+        client = Client(ws, self.maxsize)
+        for frame in frames: client.push(frame, self.policy)
+        self.clients.add(client)
+        try:
+            async with anyio.create_task_group() as tg:
+                tg.start_soon(self._read_loop, client)
+                await self._send_loop(client)
+                tg.cancel_scope.cancel()
+        finally:
+            self._evict(client)
+        try: await ws.close()
+        except Exception: pass
+
+    async def _send_loop(self, client):
+        while not client.closed:
+            if not client.queue:
+                client.wakeup.clear()
+                try: await asyncio.wait_for(client.wakeup.wait(), self.heartbeat)
+                except asyncio.TimeoutError: client.queue.append(PING)
+                continue
+            frame = client.queue.popleft()
+            try: await asyncio.wait_for(client.ws.send_text(frame), self.send_timeout)
+            except Exception as e: return self._evict(client, f"send failed ({type(e).__name__})")
+
+    async def _read_loop(self, client):
+        # Dashboards never send anything; reading is how a closed socket is noticed.
+        try:
+            while True:
+                if (await client.ws.receive())["type"] == "websocket.disconnect": break
+        except (WebSocketDisconnect, RuntimeError):
+            pass
+        self._evict(client)
@@ -1,35 +1,16 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Query
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi import FastAPI, WebSocket, Query, HTTPException, Request, Response
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-import datetime, asyncio, json, random, os
+from sqlalchemy import select, tuple_
+from contextlib import asynccontextmanager
+import datetime, csv, io, json, random, os
 
 # ── Database Setup ────────────────────────────────────────────────
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = os.path.join(BASE_DIR, "whatsflow.db")
-engine = create_engine(f"sqlite:///{DB_PATH}", connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(bind=engine)
-Base = declarative_base()
-
-class Message(Base):
-    __tablename__ = "messages"
-    id        = Column(Integer, primary_key=True, index=True)
-    sender    = Column(String(100), nullable=False)
-    text      = Column(Text, nullable=False)
-    status    = Column(String(20), default="received")
-    timestamp = Column(DateTime, default=datetime.datetime.utcnow)
-
-class User(Base):
-    __tablename__ = "users"
-    id            = Column(Integer, primary_key=True)
-    phone         = Column(String(50), unique=True, nullable=False)
-    first_seen    = Column(DateTime, default=datetime.datetime.utcnow)
-    last_seen     = Column(DateTime, default=datetime.datetime.utcnow)
-    message_count = Column(Integer, default=0)
-
-Base.metadata.create_all(bind=engine)
+from app.db import BASE_DIR, engine, SessionLocal, Message, User, create_schema, startup_lock, run_read, run_write
+from app import stats, activity, metrics, webhook, backplane as bp, search as fts
+from app.bot import Bot
+from app.hub import Hub
+from app.events import EventLog
 
 def seed_data():
     db = SessionLocal()
@@ -43,111 +24,259 @@ def seed_data():
             Message(sender="Bot",             text="You're welcome! Type anything to chat.", status="sent", timestamp=datetime.datetime.now()-datetime.timedelta(minutes=4)),
         ]
         db.add_all(seeds)
-        db.add_all([User(phone="+49 176 1234567", message_count=2), User(phone="+49 152 9876543", message_count=1)])
+        known = {p for (p,) in db.query(User.phone)}
+        db.add_all([u for u in (User(phone="+49 176 1234567", message_count=2), User(phone="+49 152 9876543", message_count=1)) if u.phone not in known])
         db.commit()
     db.close()
 
-seed_data()
+# Every worker runs this on import; the lock keeps them from racing on a fresh database.
+with startup_lock():
+    create_schema()
+    fts.install()
+    seed_data()
+    if os.environ.get("WHATSFLOW_STATS_RECONCILE", "1") != "0": stats.reconcile()
+    activity.ensure_backfilled()
 
 # ── App ───────────────────────────────────────────────────────────
-app = FastAPI(title="WhatsFlow API")
+@asynccontextmanager
+async def lifespan(app):
+    await backplane.start(lambda seq, event: events.append(event, seq))
+    events.epoch, events.seq = backplane.epoch, backplane.seq
+    ingestor.start()
+    bot.start()
+    yield
+    await ingestor.stop()
+    await bot.stop()
+    await backplane.stop()
+
+app = FastAPI(title="WhatsFlow API", lifespan=lifespan)
+app.add_middleware(metrics.MetricsMiddleware)
 FRONTEND_DIR = os.path.join(BASE_DIR, "frontend")
 if os.path.exists(FRONTEND_DIR):
     app.mount("/static", StaticFiles(directory=FRONTEND_DIR), name="static")
 
-connected_clients = []
+hub = Hub.from_env()
+metrics.watch_hub(hub)
+events = EventLog(hub.publish)
+backplane = bp.from_env()
+
+async def broadcast(event):
+    # Goes out through the backplane so dashboards on every worker see it.
+    with metrics.broadcast_seconds.time("publish"): await backplane.publish(event)
+
+# Push the changed user rows with every update so dashboards never refetch
+# /api/users; with this off they fall back to a (304-friendly) refetch. Init
+# frames carry the setting, so an update without users (a bot reply) is never
+# mistaken for push being off.
+USERS_PUSH = os.environ.get("WHATSFLOW_USERS_PUSH", "1") != "0"
 
-async def broadcast(data):
-    dead = []
-    for ws in connected_clients:
-        try: await ws.send_text(json.dumps(data))
-        except: dead.append(ws)
-    for ws in dead: connected_clients.remove(ws)
+async def on_written(rows, users):
+    new = [{"id": r["id"], "from": r["sender"], "text": r["text"], "status": r["status"], "time": r["timestamp"].strftime("%H:%M:%S")} for r in rows]
+    update = {"type":"update","messages":new,"stats":await run_read(get_stats)}
+    if USERS_PUSH and users: update["users"] = users_to_list(users)
+    await broadcast(update)
+
+async def on_ingested(rows, users):
+    await on_written(rows, users)
+    bot.submit(rows)
+
+ingestor = webhook.Ingestor(on_batch=on_ingested)
+bot = Bot(on_batch=on_written)
 
 def get_stats():
     db = SessionLocal()
-    s = {"total": db.query(Message).count(),
-         "received": db.query(Message).filter(Message.status=="received").count(),
-         "sent": db.query(Message).filter(Message.status=="sent").count(),
-         "failed": db.query(Message).filter(Message.status=="failed").count(),
-         "users": db.query(User).count()}
+    s = stats.read(db)
     db.close()
     return s
 
 def get_hourly():
     db = SessionLocal()
-    now = datetime.datetime.now()
-    result = []
-    for h in range(24):
-        start = now.replace(hour=h, minute=0, second=0, microsecond=0)
-        end = start + datetime.timedelta(hours=1)
-        result.append(db.query(Message).filter(Message.timestamp >= start, Message.timestamp < end).count())
+    start = activity.floor(datetime.datetime.now(), "day")
+    result = [b["count"] for b in activity.series(db, start, start + datetime.timedelta(days=1))]
     db.close()
     return result
 
+def naive_utc(ts):
+    # Timestamps are stored naive (UTC for ingested messages); query params
+    # with an offset are converted so they compare against them.
+    if ts is None or ts.tzinfo is None: return ts
+    return ts.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+def users_to_list(users):
+    return [{"phone": u.phone, "first_seen": str(u.first_seen)[:16], "last_seen": str(u.last_seen)[:16], "messages": u.message_count} for u in users]
+
 def msgs_to_list(msgs):
     return [{"id": m.id, "from": m.sender, "text": m.text, "status": m.status, "time": m.timestamp.strftime("%H:%M:%S")} for m in msgs]
 
+def get_init(limit=20):
+    db = SessionLocal()
+    msgs = db.query(Message).order_by(Message.timestamp.desc()).limit(limit).all()
+    db.close()
+    return {"type":"init","messages":msgs_to_list(reversed(msgs)),"stats":get_stats(),"hourly":get_hourly(),"users_push":USERS_PUSH}
+
 @app.websocket("/ws")
 async def ws_endpoint(websocket: WebSocket):
+    # ?since=<epoch>.<seq> resumes from the replay buffer; otherwise (or if the
+    # gap is too old) send a snapshot, plus whatever was published while it was read.
     await websocket.accept()
-    connected_clients.append(websocket)
+    frames = events.since(websocket.query_params.get("since"))
+    if frames is None:
+        seq = events.seq
+        snapshot = {**await run_read(get_init), "epoch": events.epoch, "seq": seq}
+        frames = [snapshot] + (events.since(f"{events.epoch}.{seq}") or [])
+    await hub.serve(websocket, *(json.dumps(f) for f in frames))
+
+@app.get("/api/messages")
+def api_messages(limit: int = Query(50, ge=1, le=1000), search: str = Query(""),
+                 before: int = Query(None), after: int = Query(None)):
+    # before/after take a message id and page by (timestamp, id) from there.
+    if search and (before or after): raise HTTPException(400, "use /api/search to page through search results")
+    if before and after: raise HTTPException(400, "pass either 'before' or 'after', not both")
     db = SessionLocal()
-    msgs = db.query(Message).order_by(Message.timestamp.desc()).limit(20).all()
-    db.close()
-    await websocket.send_text(json.dumps({"type":"init","messages":msgs_to_list(reversed(msgs)),"stats":get_stats(),"hourly":get_hourly()}))
     try:
-        while True: await asyncio.sleep(30)
-    except WebSocketDisconnect:
-        if websocket in connected_clients: connected_clients.remove(websocket)
+        if search: return msgs_to_list(reversed(fts.query(db, search, limit)[0]))
+        key = (Message.timestamp, Message.id)
+        q = db.query(Message)
+        cursor = before or after
+        if cursor:
+            anchor = db.get(Message, cursor)
+            if anchor is None: raise HTTPException(404, f"message {cursor} not found")
+            pos = tuple_(anchor.timestamp, anchor.id)
+            if after: return msgs_to_list(q.filter(tuple_(*key) > pos).order_by(*key).limit(limit).all())
+            q = q.filter(tuple_(*key) < pos)
+        return msgs_to_list(reversed(q.order_by(*(k.desc() for k in key)).limit(limit).all()))
+    finally:
+        db.close()
 
-@app.get("/api/messages")
-def api_messages(limit: int = Query(50), search: str = Query("")):
+EXPORT_CHUNK = int(os.environ.get("WHATSFLOW_EXPORT_CHUNK", 1000))
+EXPORT_FIELDS = ["id", "from", "text", "status", "timestamp"]
+
+def export_rows(fmt, start=None, end=None):
+    # Streams straight off one SQLite cursor, EXPORT_CHUNK rows per yielded chunk,
+    # so memory stays flat however many rows match.
+    q = select(Message.id, Message.sender, Message.text, Message.status, Message.timestamp).order_by(Message.timestamp, Message.id)
+    if start: q = q.where(Message.timestamp >= start)
+    if end: q = q.where(Message.timestamp < end)
+    if fmt == "csv": yield ",".join(EXPORT_FIELDS) + "\r\n"
+    with engine.connect() as conn:
+        for rows in conn.execution_options(yield_per=EXPORT_CHUNK).execute(q).partitions():
+            rows = [(i, sender, text, status, ts.isoformat() if ts else None) for i, sender, text, status, ts in rows]
+            if fmt == "csv":
+                buf = io.StringIO()
+                csv.writer(buf).writerows(rows)
+                yield buf.getvalue()
+            else:
+                yield "".join(json.dumps(dict(zip(EXPORT_FIELDS, r)), ensure_ascii=False) + "\n" for r in rows)
+
+@app.get("/api/messages/export")
+def api_export(fmt: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$"),
+               start: datetime.datetime = Query(None, alias="from"), end: datetime.datetime = Query(None, alias="to")):
+    media = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    return StreamingResponse(export_rows(fmt, naive_utc(start), naive_utc(end)), media_type=media,
+                             headers={"Content-Disposition": f"attachment; filename=whatsflow-messages.{fmt}"})
+
+@app.get("/api/search")
+def api_search(q: str = Query(...), limit: int = Query(50, ge=1, le=500), cursor: str = Query(None),
+               sort: str = Query("recent", pattern="^(recent|rank)$")):
     db = SessionLocal()
-    q = db.query(Message).order_by(Message.timestamp.desc())
-    if search: q = q.filter(Message.text.contains(search) | Message.sender.contains(search))
-    msgs = q.limit(limit).all()
-    db.close()
-    return msgs_to_list(reversed(msgs))
+    try: msgs, nxt = fts.query(db, q, limit, cursor, sort)
+    except ValueError: raise HTTPException(400, "invalid cursor")
+    finally: db.close()
+    return {"results": msgs_to_list(msgs), "next": nxt}
 
 @app.get("/api/stats")
 def api_stats(): return get_stats()
 
-@app.get("/api/users")
-def api_users():
+@app.get("/api/activity")
+def api_activity(start: datetime.datetime = Query(None, alias="from"), end: datetime.datetime = Query(None, alias="to"),
+                 bucket: str = Query("hour", pattern="^(hour|day)$")):
+    start, end = naive_utc(start), naive_utc(end) or datetime.datetime.utcnow()
+    start = start or end - (datetime.timedelta(hours=24) if bucket == "hour" else datetime.timedelta(days=30))
+    if start >= end: raise HTTPException(400, "'from' must be before 'to'")
+    if (end - start) / activity.SIZES[bucket][1] > 1000: raise HTTPException(400, "range too large, use a coarser bucket")
     db = SessionLocal()
-    users = db.query(User).order_by(User.last_seen.desc()).all()
+    result = activity.series(db, start, end, bucket)
     db.close()
-    return [{"phone": u.phone, "first_seen": str(u.first_seen)[:16], "last_seen": str(u.last_seen)[:16], "messages": u.message_count} for u in users]
+    return result
 
-@app.post("/simulate")
-async def simulate():
-    phones = ["+49 176 5551234", "+49 152 7779988", "+49 160 3334455", "+49 176 1234567"]
-    texts  = ["Hello!", "Any updates?", "Thanks 🙏", "How does this work?", "Great bot! 👍", "Need help please"]
-    phone  = random.choice(phones)
-    db     = SessionLocal()
-    incoming = Message(sender=phone, text=random.choice(texts), status="received")
+@app.get("/api/users")
+def api_users(request: Request, limit: int = Query(50, ge=1, le=1000), before: str = Query(None)):
+    # Most recently active first; before=<phone> continues after that user.
+    db = SessionLocal()
+    try:
+        # Read the version first: data newer than its tag is harmless, older is not.
+        etag = f'W/"users-{stats.version(db)}"'
+        if etag in [t.strip() for t in request.headers.get("if-none-match", "").split(",")]:
+            return Response(status_code=304, headers={"ETag": etag})
+        key = (User.last_seen, User.id)
+        q = db.query(User)
+        if before:
+            anchor = db.query(User).filter(User.phone == before).first()
+            if anchor is None: raise HTTPException(404, f"user {before} not found")
+            q = q.filter(tuple_(*key) < tuple_(anchor.last_seen, anchor.id))
+        users = q.order_by(*(k.desc() for k in key)).limit(limit).all()
+        return JSONResponse(users_to_list(users), headers={"ETag": etag, "Cache-Control": "no-cache"})
+    finally:
+        db.close()
+
+def store_message(phone, text):
+    db = SessionLocal()
+    incoming = Message(sender=phone, text=text, status="received")
     db.add(incoming)
     user = db.query(User).filter(User.phone==phone).first()
     if user: user.last_seen=datetime.datetime.now(); user.message_count+=1
-    else: db.add(User(phone=phone, message_count=1))
-    reply = Message(sender="Bot", text=random.choice(["Got it! 🤖","Thanks for reaching out!","How can I help? 😊","Message received ✅"]), status="sent")
-    db.add(reply)
+    else: user = User(phone=phone, message_count=1); db.add(user)
+    db.flush()
+    new = msgs_to_list([incoming])
     db.commit()
-    recent = db.query(Message).order_by(Message.timestamp.desc()).limit(6).all()
+    update = {"type":"update","messages":new,"stats":get_stats()}
+    if USERS_PUSH: update["users"] = users_to_list([user])
     db.close()
-    await broadcast({"type":"update","messages":msgs_to_list(reversed(recent)),"stats":get_stats()})
+    return update
+
+@app.post("/simulate")
+async def simulate():
+    phones = ["+49 176 5551234", "+49 152 7779988", "+49 160 3334455", "+49 176 1234567"]
+    texts  = ["Hello!", "Any updates?", "Thanks 🙏", "How does this work?", "Great bot! 👍", "Need help please", "Where is order #10234?"]
+    phone, text = random.choice(phones), random.choice(texts)
+    await broadcast(await run_write(store_message, phone, text))
+    bot.submit([{"sender": phone, "text": text}])  # the reply follows as its own update
     return {"ok": True}
 
-@app.delete("/api/messages/clear")
-async def clear_messages():
+def clear_all():
     db = SessionLocal()
     db.query(Message).delete()
+    stats.reset_messages(db)
+    activity.reset(db)
     db.commit()
     db.close()
-    await broadcast({"type":"init","messages":[],"stats":get_stats(),"hourly":get_hourly()})
+    return {"type":"init","messages":[],"stats":get_stats(),"hourly":get_hourly(),"users_push":USERS_PUSH}
+
+@app.delete("/api/messages/clear")
+async def clear_messages():
+    await broadcast(await run_write(clear_all))
     return {"ok": True}
 
+@app.get("/webhook")
+def webhook_verify(mode: str = Query("", alias="hub.mode"), token: str = Query("", alias="hub.verify_token"),
+                   challenge: str = Query("", alias="hub.challenge")):
+    # Cloud API subscription handshake: echo the challenge if the token matches.
+    if mode == "subscribe" and webhook.VERIFY_TOKEN and token == webhook.VERIFY_TOKEN: return PlainTextResponse(challenge)
+    raise HTTPException(403, "verification failed")
+
+@app.post("/webhook")
+async def webhook_receive(request: Request):
+    body = await request.body()
+    if not webhook.valid_signature(body, request.headers.get("X-Hub-Signature-256")): raise HTTPException(401, "invalid signature")
+    try: rows = webhook.parse(json.loads(body))
+    except (ValueError, TypeError, AttributeError): raise HTTPException(400, "malformed payload")
+    if rows and not await ingestor.submit(rows): return Response(status_code=503, headers={"Retry-After": "1"})
+    return {"ok": True, "queued": len(rows)}
+
+@app.get("/metrics", include_in_schema=False)
+async def api_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/", response_class=HTMLResponse)
 def dashboard():
     return HTMLResponse(HTML)
@@ -298,7 +427,7 @@ main{position:relative;z-index:1;padding:2rem;max-width:1400px;margin:0 auto;}
         <div class="workflow-item"><div class="wf-icon" style="background:rgba(0,255,136,.1)">🚀</div><div class="wf-info"><div class="wf-name">Bot Engine</div><div class="wf-time">Online</div></div><div class="wf-badge completed">Active</div></div>
         <div class="workflow-item"><div class="wf-icon" style="background:rgba(255,214,0,.1)">🗄️</div><div class="wf-info"><div class="wf-name">SQLite DB</div><div class="wf-time">whatsflow.db</div></div><div class="wf-badge completed">Active</div></div>
         <div class="workflow-item"><div class="wf-icon" style="background:rgba(0,212,255,.1)">🔌</div><div class="wf-info"><div class="wf-name">WebSocket</div><div class="wf-time">Real-time</div></div><div class="wf-badge running" id="wf-ws">Connecting</div></div>
-        <div class="workflow-item"><div class="wf-icon" style="background:rgba(176,136,255,.1)">🔗</div><div class="wf-info"><div class="wf-name">Webhook</div><div class="wf-time">/webhook</div></div><div class="wf-badge pending">Pending</div></div>
+        <div class="workflow-item"><div class="wf-icon" style="background:rgba(176,136,255,.1)">🔗</div><div class="wf-info"><div class="wf-name">Webhook</div><div class="wf-time">/webhook</div></div><div class="wf-badge completed">Active</div></div>
       </div>
     </div>
     <div class="panel">
@@ -315,26 +444,36 @@ main{position:relative;z-index:1;padding:2rem;max-width:1400px;margin:0 auto;}
 <script>
 function tick(){document.getElementById("clock").textContent=new Date().toLocaleTimeString("de-DE");}
 tick();setInterval(tick,1000);
-let ws;
+let ws,epoch=null,lastSeq=0,resync=false,usersPush=false;const seen=new Set();
 function connect(){
-  ws=new WebSocket("ws://"+location.host+"/ws");
+  ws=new WebSocket("ws://"+location.host+"/ws"+(epoch?`?since=${epoch}.${lastSeq}`:""));
   ws.onopen=()=>{document.getElementById("ws-dot").classList.add("connected");document.getElementById("ws-status").textContent="WebSocket: Connected ✓";document.getElementById("wf-ws").textContent="Active";document.getElementById("wf-ws").className="wf-badge completed";};
-  ws.onclose=()=>{document.getElementById("ws-dot").classList.remove("connected");document.getElementById("ws-status").textContent="Reconnecting...";setTimeout(connect,3000);};
-  ws.onmessage=e=>{const d=JSON.parse(e.data);if(d.type==="init"){updateStats(d.stats);renderMessages(d.messages);renderChart(d.hourly);loadUsers();}else if(d.type==="update"){updateStats(d.stats);renderMessages(d.messages,true);loadUsers();}};
+  ws.onclose=()=>{document.getElementById("ws-dot").classList.remove("connected");document.getElementById("ws-status").textContent="Reconnecting...";setTimeout(connect,resync?0:3000);resync=false;};
+  ws.onmessage=e=>{const d=JSON.parse(e.data);
+    if(d.type==="init"){epoch=d.epoch;lastSeq=d.seq;usersPush=!!d.users_push;updateStats(d.stats);renderMessages(d.messages);renderChart(d.hourly);loadUsers();}
+    else if(d.type==="update"){
+      if(d.seq<=lastSeq)return;
+      if(d.base>lastSeq){resync=true;ws.close();return;}
+      lastSeq=d.seq;updateStats(d.stats);if(d.truncated)reloadMessages();else renderMessages(d.messages.filter(m=>!seen.has(m.id)),true);if(d.users)mergeUsers(d.users);else if(!usersPush)loadUsers();}};
 }
 connect();
 function animCount(el,target){let v=parseInt(el.textContent)||0;const t=setInterval(()=>{v=Math.min(v+Math.max(1,Math.ceil((target-v)/10)),target);el.textContent=v;if(v>=target)clearInterval(t);},40);}
-function updateStats(s){animCount(document.getElementById("s-total"),s.total);animCount(document.getElementById("s-received"),s.received);animCount(document.getElementById("s-sent"),s.sent);animCount(document.getElementById("s-failed"),s.failed);animCount(document.getElementById("s-users"),s.users);document.getElementById("msg-count").textContent=s.total+" total";}
+function updateStats(s){["total","received","sent","failed","users"].forEach(k=>{if(k in s)animCount(document.getElementById("s-"+k),s[k]);});if("total" in s)document.getElementById("msg-count").textContent=s.total+" total";if("users" in s)document.getElementById("user-count").textContent=s.users+" users";}
+function esc(s){return String(s??"").replace(/[&<>"']/g,c=>({"&":"&amp;","<":"&lt;",">":"&gt;",'"':"&quot;","'":"&#39;"})[c]);}
 function renderMessages(msgs,append=false){
   const list=document.getElementById("messages-list");
-  if(!append)list.innerHTML="";
-  msgs.forEach(m=>{const div=document.createElement("div");div.className="msg-item";div.innerHTML=`<div class="msg-avatar ${m.status}">${m.from==="Bot"?"🤖":"👤"}</div><div class="msg-body"><div class="msg-from">${m.from}</div><div class="msg-text">${m.text}</div><span class="msg-status ${m.status}">${m.status}</span></div><div class="msg-time">${m.time}</div>`;list.appendChild(div);});
+  if(!append){list.innerHTML="";seen.clear();}
+  msgs.forEach(m=>{seen.add(m.id);const div=document.createElement("div");div.className="msg-item";div.innerHTML=`<div class="msg-avatar ${m.status}">${m.from==="Bot"?"🤖":"👤"}</div><div class="msg-body"><div class="msg-from">${esc(m.from)}</div><div class="msg-text">${esc(m.text)}</div><span class="msg-status ${m.status}">${m.status}</span></div><div class="msg-time">${m.time}</div>`;list.appendChild(div);});
   list.scrollTop=list.scrollHeight;
 }
+async function reloadMessages(){const res=await fetch("/api/messages?limit=50");renderMessages(await res.json());}
 let searchTimer;
 function searchMessages(){clearTimeout(searchTimer);searchTimer=setTimeout(async()=>{const q=document.getElementById("search-input").value;const res=await fetch(`/api/messages?search=${encodeURIComponent(q)}&limit=50`);renderMessages(await res.json());},300);}
 function renderChart(hourly){const max=Math.max(...hourly,1);const container=document.getElementById("chart-bars");container.innerHTML="";hourly.forEach((val,i)=>{const pct=(val/max)*100;const isMax=val===max&&val>0;const col=document.createElement("div");col.className="bar-col";col.innerHTML=`<div class="bar" style="height:${Math.max(pct,3)}%;${isMax?"background:linear-gradient(to top,var(--cyan),#88ffee);":""}" title="${val} msgs at ${i}:00"></div><div class="bar-label">${i%4===0?i:""}</div>`;container.appendChild(col);});}
-async function loadUsers(){const res=await fetch("/api/users");const users=await res.json();document.getElementById("user-count").textContent=users.length+" users";const list=document.getElementById("users-list");list.innerHTML="";users.forEach(u=>{const div=document.createElement("div");div.className="user-row";div.innerHTML=`<div class="user-avatar">👤</div><div class="user-info"><div class="user-phone">${u.phone}</div><div class="user-meta">Last: ${u.last_seen.substring(11)}</div></div><div class="user-count">${u.messages} msgs</div>`;list.appendChild(div);});}
+const USER_LIMIT=50;let users=[];
+async function loadUsers(){const res=await fetch("/api/users?limit="+USER_LIMIT);users=await res.json();renderUsers();}
+function mergeUsers(changed){const byPhone=new Map(users.map(u=>[u.phone,u]));changed.forEach(u=>byPhone.set(u.phone,u));users=[...byPhone.values()].sort((a,b)=>b.last_seen.localeCompare(a.last_seen)).slice(0,USER_LIMIT);renderUsers();}
+function renderUsers(){const list=document.getElementById("users-list");list.innerHTML="";users.forEach(u=>{const div=document.createElement("div");div.className="user-row";div.innerHTML=`<div class="user-avatar">👤</div><div class="user-info"><div class="user-phone">${esc(u.phone)}</div><div class="user-meta">Last: ${u.last_seen.substring(11)}</div></div><div class="user-count">${u.messages} msgs</div>`;list.appendChild(div);});}
 async function simulate(){const btn=document.querySelector(".sim-btn");btn.textContent="⏳ Sending...";btn.disabled=true;await fetch("/simulate",{method:"POST"});setTimeout(()=>{btn.textContent="⚡ Simulate Message";btn.disabled=false;},800);}
 async function clearMessages(){if(!confirm("Clear all messages from database?"))return;await fetch("/api/messages/clear",{method:"DELETE"});}
 </script>
@@ -0,0 +1,191 @@
+# WhatsFlow Metrics
+# Prometheus text-format metrics for GET /metrics, without a client library:
+# counters, gauges and fixed-bucket histograms whose label sets are bounded
+# (route templates, never raw paths), so memory stays flat however long the
+# process runs. Metrics are per process; with several workers each scrape
+# sees the worker that answered it.
+#
+#   whatsflow_http_*       per-route latency, plus DB queries and DB time per route
+#   whatsflow_db_*         every SQL statement's duration (SQLAlchemy cursor events)
+#   whatsflow_ws_*         connected dashboards, send-queue depths, evictions, dropped frames
+#   whatsflow_broadcast_*  time spent publishing, encoding and fanning out updates
+#   whatsflow_bot_*        replies sent/failed and messages the bot had no room for
+#
+# WHATSFLOW_SLOW_MS=<ms> logs every request slower than that with its queries.
+from contextlib import contextmanager
+from contextvars import ContextVar
+from sqlalchemy import event
+from app.db import engine
+import bisect, logging, os, threading, time
+
+log = logging.getLogger("whatsflow.metrics")
+
+SLOW_MS     = float(os.environ.get("WHATSFLOW_SLOW_MS", 0))
+SLOW_LOG    = 50  # queries kept per request for the slow log
+LATENCY     = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+QUEUE_DEPTH = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256)
+REGISTRY    = []
+
+def _labels(names, values):
+    if not names: return ""
+    esc = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{n}="{esc(v)}"' for n, v in zip(names, values)) + "}"
+
+def _num(v):
+    return str(v) if isinstance(v, int) else repr(float(v))
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help, labels=(), fn=None):
+        # `fn` makes the metric collected at scrape time instead of recorded.
+        self.name, self.help, self.labels, self.fn = name, help, tuple(labels), fn
+        self.values = {}
+        self.lock   = threading.Lock()
+        REGISTRY.append(self)
+
+    def collect(self):
+        with self.lock: return dict(self.values)
+
+    def render(self):
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in sorted(self.collect().items()):
+            out.append(f"{self.name}{_labels(self.labels, labels)} {_num(value)}")
+        return out
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, by=1):
+        with self.lock: self.values[labels] = self.values.get(labels, 0) + by
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def collect(self):
+        return {(): self.fn()} if self.fn else super().collect()
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY, fn=None):
+        super().__init__(name, help, labels, fn)
+        self.buckets = buckets
+
+    def _observe(self, values, value, labels):
+        h = values.get(labels)
+        if h is None: h = values[labels] = [0] * (len(self.buckets) + 1) + [0.0]  # per bucket, +Inf, sum
+        h[bisect.bisect_left(self.buckets, value)] += 1
+        h[-1] += value
+
+    def observe(self, value, *labels):
+        with self.lock: self._observe(self.values, value, labels)
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try: yield
+        finally: self.observe(time.perf_counter() - start, *labels)
+
+    def collect(self):
+        if not self.fn: return {k: list(v) for k, v in super().collect().items()}
+        values = {}
+        for value in self.fn(): self._observe(values, value, ())
+        return values
+
+    def render(self):
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for labels, h in sorted(self.collect().items()):
+            total = 0
+            for le, n in zip(self.buckets + ("+Inf",), h):
+                total += n
+                out.append(f"{self.name}_bucket{_labels(self.labels + ('le',), labels + (le,))} {total}")
+            out.append(f"{self.name}_sum{_labels(self.labels, labels)} {_num(h[-1])}")
+            out.append(f"{self.name}_count{_labels(self.labels, labels)} {total}")
+        return out
+
+def render():
+    return "\n".join(line for m in REGISTRY for line in m.render()) + "\n"
+
+# ── Metrics ───────────────────────────────────────────────────────
+HTTP_LABELS       = ("method", "route", "status")
+http_seconds      = Histogram("whatsflow_http_request_duration_seconds", "HTTP request latency by route template", HTTP_LABELS)
+http_queries      = Counter("whatsflow_http_db_queries_total", "SQL statements run while serving requests, by route", ("method", "route"))
+http_db_seconds   = Counter("whatsflow_http_db_seconds_total", "Time spent in SQL while serving requests, by route", ("method", "route"))
+db_seconds        = Histogram("whatsflow_db_query_duration_seconds", "Duration of every SQL statement, requests and background work alike")
+ws_clients        = Gauge("whatsflow_ws_clients", "Connected /ws dashboards", fn=lambda: 0)
+ws_queue_depth    = Histogram("whatsflow_ws_send_queue_depth", "Frames waiting in each dashboard's send queue, sampled at scrape time",
+                              buckets=QUEUE_DEPTH, fn=lambda: ())
+ws_evictions      = Counter("whatsflow_ws_evictions_total", "Dashboard sockets removed from the hub, by reason", ("reason",))
+ws_dropped_frames = Counter("whatsflow_ws_dropped_frames_total", "Frames discarded by the slow-consumer policy")
+broadcast_seconds = Histogram("whatsflow_broadcast_duration_seconds",
+                              "Broadcast time by stage: publish (backplane hop), encode (JSON), fanout (queueing to every socket)", ("stage",))
+bot_replies       = Counter("whatsflow_bot_replies_total", "Bot replies by outcome", ("status",))
+bot_dropped       = Counter("whatsflow_bot_dropped_total", "Inbound messages left unanswered because the bot queue was full")
+
+def watch_hub(hub):
+    ws_clients.fn     = lambda: len(hub)
+    ws_queue_depth.fn = lambda: [len(c.queue) for c in list(hub.clients)]
+
+# ── Per-request accounting ────────────────────────────────────────
+# The request's tally rides in a ContextVar, which follows the work into the
+# threadpool and the app.db executors, so queries land on the right request.
+class Tally:
+    __slots__ = ("queries", "db_seconds", "log")
+
+    def __init__(self):
+        self.queries, self.db_seconds, self.log = 0, 0.0, []
+
+_tally = ContextVar("whatsflow_request_tally", default=None)
+
+@event.listens_for(engine, "before_cursor_execute")
+def _before_query(conn, cursor, statement, params, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+@event.listens_for(engine, "after_cursor_execute")
+def _after_query(conn, cursor, statement, params, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    db_seconds.observe(elapsed)
+    tally = _tally.get()
+    if tally is None: return
+    tally.queries += 1
+    tally.db_seconds += elapsed
+    if SLOW_MS and len(tally.log) < SLOW_LOG: tally.log.append((elapsed, statement))
+
+@event.listens_for(engine, "handle_error")
+def _failed_query(ctx):
+    starts = ctx.connection.info.get("query_start") if ctx.connection is not None else None
+    if starts: starts.pop()
+
+class MetricsMiddleware:
+    # Plain ASGI, so streamed responses are timed to their last byte.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http": return await self.app(scope, receive, send)
+        status, tally = 500, Tally()
+
+        async def send_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start": status = message["status"]
+            await send(message)
+
+        token, start = _tally.set(tally), time.perf_counter()
+        try: await self.app(scope, receive, send_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            _tally.reset(token)
+            method, route = scope["method"], getattr(scope.get("route"), "path", "unmatched")
+            http_seconds.observe(elapsed, method, route, f"{status // 100}xx")
+            if tally.queries:
+                http_queries.inc(method, route, by=tally.queries)
+                http_db_seconds.inc(method, route, by=tally.db_seconds)
+            if SLOW_MS and elapsed * 1000 >= SLOW_MS: log_slow(scope, status, elapsed, tally)
+
+def log_slow(scope, status, elapsed, tally):
+    path = scope["path"] + ("?" + scope["query_string"].decode("latin-1") if scope.get("query_string") else "")
+    lines = [f"\n  {t * 1000:8.1f}ms  {' '.join(sql.split())[:300]}" for t, sql in tally.log]
+    if tally.queries > len(tally.log): lines.append(f"\n  ... {tally.queries - len(tally.log)} more")
+    log.warning("slow request: %s %s -> %d in %.0fms, %d queries / %.0fms in SQL%s", scope["method"], path, status,
+                elapsed * 1000, tally.queries, tally.db_seconds * 1000, "".join(lines))
@@ -0,0 +1,83 @@
+# WhatsFlow Search
+# Full-text index over message text and sender, in a contentless SQLite FTS5
+# table kept in sync by triggers (so every write path is covered, ORM or not).
+# Senders are also indexed with spaces, "+" and "-" stripped, so "+49 176 12"
+# and "4917612" both find "+49 176 1234567" by prefix.
+#
+#   python -m app.search rebuild    re-index every message
+from sqlalchemy import text
+from app.db import engine, Message, create_schema
+import re, sys
+
+DIGITS = "replace(replace(replace({0}, ' ', ''), '+', ''), '-', '')"
+
+DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+    "text, sender, sender_digits, content='', prefix='2 3', tokenize='unicode61 remove_diacritics 2')",
+    f"""CREATE TRIGGER IF NOT EXISTS messages_fts_ai AFTER INSERT ON messages BEGIN
+        INSERT INTO messages_fts(rowid, text, sender, sender_digits) VALUES (new.id, new.text, new.sender, {DIGITS.format('new.sender')});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS messages_fts_ad AFTER DELETE ON messages BEGIN
+        INSERT INTO messages_fts(messages_fts, rowid, text, sender, sender_digits) VALUES ('delete', old.id, old.text, old.sender, {DIGITS.format('old.sender')});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS messages_fts_au AFTER UPDATE OF text, sender ON messages BEGIN
+        INSERT INTO messages_fts(messages_fts, rowid, text, sender, sender_digits) VALUES ('delete', old.id, old.text, old.sender, {DIGITS.format('old.sender')});
+        INSERT INTO messages_fts(rowid, text, sender, sender_digits) VALUES (new.id, new.text, new.sender, {DIGITS.format('new.sender')});
+    END""",
+]
+
+PHONE = re.compile(r"[\d\s+\-()]+")
+
+def match_expr(search):
+    # Every word is a quoted prefix term, so user input can't inject FTS syntax.
+    words = re.findall(r"\w+", search)
+    if not words: return None
+    expr = "{text sender} : (" + " AND ".join(f'"{w}"*' for w in words) + ")"
+    digits = re.sub(r"\D", "", search)
+    if PHONE.fullmatch(search.strip()) and len(digits) >= 2: expr += f' OR sender_digits : "{digits}"*'
+    return expr
+
+def query(db, search, limit=50, cursor=None, sort="recent"):
+    # One page of matches, newest first or best bm25 rank first, plus the cursor
+    # for the next page (None when exhausted).
+    expr = match_expr(search)
+    if expr is None: return [], None
+    params = {"q": expr, "n": limit + 1}
+    if sort == "rank":
+        where = ""
+        if cursor:
+            r, i = cursor.rsplit(":", 1)
+            where, params = "AND (rank > :r OR (rank = :r AND rowid > :i))", {**params, "r": float(r), "i": int(i)}
+        sql = f"SELECT rowid, rank FROM messages_fts WHERE messages_fts MATCH :q {where} ORDER BY rank, rowid LIMIT :n"
+    else:
+        where = ""
+        if cursor: where, params = "AND rowid < :i", {**params, "i": int(cursor)}
+        sql = f"SELECT rowid, 0 FROM messages_fts WHERE messages_fts MATCH :q {where} ORDER BY rowid DESC LIMIT :n"
+    hits = db.execute(text(sql), params).all()
+    more, hits = len(hits) > limit, hits[:limit]
+    by_id = {m.id: m for m in db.query(Message).filter(Message.id.in_([h[0] for h in hits]))}
+    msgs = [by_id[h[0]] for h in hits if h[0] in by_id]
+    if not more or not hits: return msgs, None
+    last_id, last_rank = hits[-1]
+    return msgs, (f"{last_rank!r}:{last_id}" if sort == "rank" else str(last_id))
+
+def rebuild(conn):
+    conn.execute(text("DROP TABLE IF EXISTS messages_fts"))
+    for stmt in DDL: conn.execute(text(stmt))
+    conn.execute(text(f"INSERT INTO messages_fts(rowid, text, sender, sender_digits) "
+                      f"SELECT id, text, sender, {DIGITS.format('sender')} FROM messages"))
+
+def install():
+    # Create the index and triggers; databases that predate them get indexed once.
+    with engine.begin() as conn:
+        if conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'")).first():
+            for stmt in DDL[1:]: conn.execute(text(stmt))
+        else:
+            rebuild(conn)
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["rebuild"]: sys.exit("usage: python -m app.search rebuild")
+    create_schema()
+    with engine.begin() as conn:
+        rebuild(conn)
+        print(conn.execute(text("SELECT count(*) FROM messages")).scalar(), "messages indexed")
@@ -0,0 +1,105 @@
+# WhatsFlow Stats
+# Per-status message counters and the user count, kept in the `stats` table and
+# bumped inside the same transaction as every write, so get_stats() is one
+# primary-key read instead of five COUNT(*) scans. The same table holds
+# users_version, bumped on every user write, which backs the /api/users ETag.
+#
+#   python -m app.stats rebuild    recount from messages/users
+from sqlalchemy import Column, Integer, String, event, func, inspect, select, text
+from sqlalchemy.dialects.sqlite import insert
+from app.db import Base, SessionLocal, Message, User, create_schema
+import logging, sys
+
+log = logging.getLogger("whatsflow.stats")
+
+STATUSES = ("received", "sent", "failed")
+KEYS     = ("total",) + STATUSES + ("users",)
+
+class Counter(Base):
+    __tablename__ = "stats"
+    name  = Column(String(20), primary_key=True)
+    value = Column(Integer, nullable=False, default=0)
+
+def bump(conn, deltas):
+    # Upsert so a missing row (fresh or hand-edited database) can't swallow a delta.
+    deltas = {k: v for k, v in deltas.items() if v}
+    if not deltas: return
+    stmt = insert(Counter.__table__).values([{"name": k, "value": v} for k, v in deltas.items()])
+    conn.execute(stmt.on_conflict_do_update(index_elements=["name"], set_={"value": Counter.__table__.c.value + stmt.excluded.value}))
+
+def message_deltas(statuses, sign=1):
+    d = {"total": 0}
+    for s in statuses:
+        d["total"] += sign
+        if s in STATUSES: d[s] = d.get(s, 0) + sign
+    return d
+
+def _merge(a, b):
+    for k, v in b.items(): a[k] = a.get(k, 0) + v
+    return a
+
+@event.listens_for(SessionLocal, "after_flush")
+def _track_flush(session, ctx):
+    # new/dirty/deleted still describe what was just flushed at this point
+    d = {}
+    for obj in session.new:
+        if isinstance(obj, Message): _merge(d, message_deltas([obj.status or "received"]))
+        elif isinstance(obj, User): _merge(d, {"users": 1, "users_version": 1})
+    for obj in session.deleted:
+        if isinstance(obj, Message): _merge(d, message_deltas([obj.status], -1))
+        elif isinstance(obj, User): _merge(d, {"users": -1, "users_version": 1})
+    for obj in session.dirty:
+        if isinstance(obj, User) and session.is_modified(obj): d["users_version"] = 1
+        if not isinstance(obj, Message): continue
+        hist = inspect(obj).attrs.status.history
+        if hist.deleted and hist.added:
+            _merge(d, message_deltas(hist.deleted, -1)); _merge(d, message_deltas(hist.added))
+    bump(session.connection(), d)
+
+def reset_messages(db):
+    # For bulk deletes that bypass the flush hook (Query.delete / raw SQL).
+    # Only the message counters: the user count and the versions live on.
+    db.execute(Counter.__table__.update().where(Counter.name.in_(("total",) + STATUSES)).values(value=0))
+
+def count_all(db):
+    counts = dict.fromkeys(KEYS, 0)
+    for status, n in db.execute(select(Message.status, func.count()).group_by(Message.status)):
+        counts["total"] += n
+        if status in STATUSES: counts[status] = n
+    counts["users"] = db.scalar(select(func.count()).select_from(User))
+    return counts
+
+def read(db):
+    s = dict.fromkeys(KEYS, 0)
+    s.update({name: value for name, value in db.execute(select(Counter.name, Counter.value).where(Counter.name.in_(KEYS)))})
+    return s
+
+def version(db, name="users_version"):
+    return db.scalar(select(Counter.value).where(Counter.name == name)) or 0
+
+def rebuild(db):
+    # Versions are left alone: resetting one could revalidate a stale ETag.
+    counts = count_all(db)
+    db.execute(Counter.__table__.delete().where(Counter.name.in_(KEYS)))
+    db.execute(Counter.__table__.insert(), [{"name": k, "value": v} for k, v in counts.items()])
+    return counts
+
+def reconcile():
+    # Startup pass: recount once and correct any drift left by out-of-band edits.
+    # Other workers may already be writing, so the write lock is taken before
+    # counting; otherwise a bump committed mid-count would be overwritten.
+    db = SessionLocal()
+    try:
+        db.execute(text("BEGIN IMMEDIATE"))
+        before = read(db)
+        after = rebuild(db)
+        db.commit()
+    finally:
+        db.close()
+    if before != after: log.warning("stats drift corrected: %s -> %s", before, after)
+    return after
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["rebuild"]: sys.exit("usage: python -m app.stats rebuild")
+    create_schema()
+    print(reconcile())
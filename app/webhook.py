@@ -0,0 +1,193 @@
+# WhatsFlow Webhook Ingest
+# WhatsApp Cloud API deliveries are verified, acknowledged and queued; a single
+# writer task drains the queue in batches (group commit) so thousands of
+# inbound messages per second cost one transaction per batch, not per message.
+#
+#   python -m app.webhook fake [url] [--rate N] [--per-request N] [--seconds N]
+#       local fake Cloud API sender for load testing
+from sqlalchemy import func, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.dialects.sqlite import insert
+from app.db import SessionLocal, Message, User, run_write
+from app import stats, activity
+import asyncio, datetime, hashlib, hmac, logging, os, random, re, time
+
+log = logging.getLogger("whatsflow.webhook")
+
+APP_SECRET   = os.environ.get("WHATSFLOW_APP_SECRET", "")
+VERIFY_TOKEN = os.environ.get("WHATSFLOW_VERIFY_TOKEN", "")
+INSECURE     = os.environ.get("WHATSFLOW_WEBHOOK_INSECURE") == "1"
+
+def valid_signature(body, header, secret=None, insecure=None):
+    # Meta signs the raw body: X-Hub-Signature-256: sha256=<hex hmac>.
+    # With no secret configured every request is rejected, unless unsigned
+    # posts were explicitly allowed (WHATSFLOW_WEBHOOK_INSECURE=1, local development).
+    secret = APP_SECRET if secret is None else secret
+    if not secret: return INSECURE if insecure is None else insecure
+    expected = "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, header or "")
+
+PHONE = re.compile(r"\+?\d{1,32}")
+
+def timestamp(value):
+    # Cloud API timestamps are epoch seconds as a string; anything unusable
+    # (missing, not a number, out of range) becomes "now".
+    try: return datetime.datetime.fromtimestamp(int(value), datetime.timezone.utc).replace(tzinfo=None)
+    except (TypeError, ValueError, OverflowError, OSError): return datetime.datetime.utcnow()
+
+def parse(payload):
+    # Flatten a Cloud API notification into (sender, text, timestamp) rows.
+    # Status callbacks (delivered/read) carry no messages and yield nothing.
+    # Messages with a malformed sender or body are skipped rather than
+    # failing the payload, which the Cloud API would only redeliver.
+    rows = []
+    for entry in payload.get("entry") or []:
+        for change in entry.get("changes") or []:
+            for m in (change.get("value") or {}).get("messages") or []:
+                sender, kind = m.get("from"), m.get("type", "text")
+                text = (m.get("text") or {}).get("body") if kind == "text" else f"[{kind}]"
+                if not isinstance(sender, str) or not PHONE.fullmatch(sender) or not isinstance(kind, str) \
+                        or not (text is None or isinstance(text, str)):
+                    log.warning("skipping malformed message %r", m.get("id"))
+                    continue
+                rows.append({"sender": "+" + sender.lstrip("+"), "text": text or f"[{kind}]", "status": "received",
+                             "timestamp": timestamp(m.get("timestamp"))})
+    return rows
+
+def write_batch(rows):
+    # One transaction: multi-row insert into messages, one users upsert, and the
+    # matching stats/activity bumps. Runs on the single DB writer thread, so the
+    # existing-phone lookup can't race another batch.
+    db = SessionLocal()
+    try:
+        conn = db.connection()
+        ids = conn.execute(insert(Message.__table__).values(rows).returning(Message.__table__.c.id)).scalars().all()
+        per_user = {}
+        for r in rows:
+            u = per_user.setdefault(r["sender"], {"phone": r["sender"], "first_seen": r["timestamp"], "last_seen": r["timestamp"], "message_count": 0})
+            u["first_seen"], u["last_seen"] = min(u["first_seen"], r["timestamp"]), max(u["last_seen"], r["timestamp"])
+            u["message_count"] += 1
+        known = set(conn.execute(select(User.phone).where(User.phone.in_(per_user))).scalars())
+        ins = insert(User.__table__).values(list(per_user.values()))
+        c = User.__table__.c
+        users = conn.execute(ins.on_conflict_do_update(index_elements=["phone"], set_={
+            "last_seen": func.max(c.last_seen, ins.excluded.last_seen),
+            "message_count": c.message_count + ins.excluded.message_count}).returning(c.phone, c.first_seen, c.last_seen, c.message_count)).all()
+        stats.bump(conn, {**stats.message_deltas([r["status"] for r in rows]), "users": len(per_user) - len(known), "users_version": 1})
+        activity.bump(conn, [r["timestamp"] for r in rows])
+        db.commit()
+    finally:
+        db.close()
+    return [{**r, "id": i} for r, i in zip(rows, sorted(ids))], users
+
+class Ingestor:
+    # `write(rows) -> (rows with ids, users)` runs on the DB writer thread;
+    # app/bot.py reuses this with its own writer for replies.
+    def __init__(self, on_batch=None, maxsize=None, batch=None, flush_ms=None, put_timeout=None, write=write_batch):
+        env = os.environ.get
+        self.queue       = asyncio.Queue(maxsize or int(env("WHATSFLOW_INGEST_QUEUE", 10000)))
+        self.batch       = batch or int(env("WHATSFLOW_INGEST_BATCH", 500))
+        self.flush       = (flush_ms or float(env("WHATSFLOW_INGEST_FLUSH_MS", 50))) / 1000
+        self.put_timeout = put_timeout if put_timeout is not None else float(env("WHATSFLOW_INGEST_PUT_TIMEOUT", 1))
+        self.on_batch    = on_batch
+        self.write       = write
+        self.task        = None
+
+    async def submit(self, rows):
+        # All-or-nothing, so a payload the Cloud API redelivers after a rejection
+        # is never half-stored. Backpressure: wait briefly for room, then return
+        # False so the caller can tell the sender to retry later.
+        deadline = time.monotonic() + self.put_timeout
+        while self.queue.maxsize - self.queue.qsize() < len(rows):
+            if len(rows) > self.queue.maxsize or time.monotonic() >= deadline:
+                log.warning("ingest queue full, rejected %d messages", len(rows))
+                return False
+            await asyncio.sleep(0.01)
+        for row in rows: self.queue.put_nowait(row)
+        return True
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # Flush whatever is still queued before shutting down.
+        if self.task is None: return
+        await self.queue.put(None)
+        await self.task
+        self.task = None
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            first = await self.queue.get()
+            if first is None: break
+            rows, deadline = [first], time.monotonic() + self.flush
+            while len(rows) < self.batch:
+                try: row = self.queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    try: row = await asyncio.wait_for(self.queue.get(), deadline - time.monotonic())
+                    except asyncio.TimeoutError: break
+                if row is None: stopping = True; break
+                rows.append(row)
+            await self._write(rows)
+
+    async def _write(self, rows):
+        delay = 0.1
+        while True:
+            try:
+                written, users = await run_write(self.write, rows)
+                break
+            except OperationalError:
+                # Locked/busy database or I/O trouble: keep the batch (the queue
+                # behind it applies backpressure) and retry.
+                log.exception("ingest batch of %d failed, retrying in %.1fs", len(rows), delay)
+                await asyncio.sleep(delay); delay = min(delay * 2, 5)
+            except Exception:
+                # Anything else fails the same way every time: halve the batch
+                # until the offending rows are isolated, and drop those.
+                if len(rows) == 1:
+                    log.exception("dropping message that cannot be stored: %r", rows[0])
+                    return
+                log.exception("ingest batch of %d failed, splitting it", len(rows))
+                half = len(rows) // 2
+                await self._write(rows[:half])
+                await self._write(rows[half:])
+                return
+        if self.on_batch:
+            try: await self.on_batch(written, users)
+            except Exception: log.exception("ingest on_batch callback failed")
+
+# ── Fake sender ───────────────────────────────────────────────────
+def fake_payload(n, phones=200):
+    now = str(int(time.time()))
+    msgs = [{"from": f"49176{random.randrange(phones):07d}", "id": f"wamid.fake{random.getrandbits(64):x}", "timestamp": now,
+             "type": "text", "text": {"body": random.choice(["Hello!", "Any updates?", "Thanks 🙏", "Need help please"])}} for _ in range(n)]
+    return {"object": "whatsapp_business_account",
+            "entry": [{"id": "0", "changes": [{"field": "messages", "value": {"messaging_product": "whatsapp", "messages": msgs}}]}]}
+
+def fake_sender(url, rate, per_request, seconds):
+    import httpx, json
+    sent = rejected = 0
+    start = time.monotonic()
+    with httpx.Client(timeout=10) as client:
+        while time.monotonic() - start < seconds:
+            body = json.dumps(fake_payload(per_request)).encode()
+            sig = "sha256=" + hmac.new(APP_SECRET.encode(), body, hashlib.sha256).hexdigest()
+            r = client.post(url, content=body, headers={"Content-Type": "application/json", "X-Hub-Signature-256": sig})
+            if r.status_code == 200: sent += per_request
+            else: rejected += per_request
+            ahead = sent / rate - (time.monotonic() - start)
+            if ahead > 0: time.sleep(ahead)
+    elapsed = time.monotonic() - start
+    print(f"sent {sent} messages in {elapsed:.1f}s ({sent / elapsed:.0f}/s), {rejected} rejected")
+
+if __name__ == "__main__":
+    import argparse
+    p = argparse.ArgumentParser(prog="python -m app.webhook")
+    p.add_argument("cmd", choices=["fake"])
+    p.add_argument("url", nargs="?", default="http://127.0.0.1:8000/webhook")
+    p.add_argument("--rate", type=float, default=1000, help="messages per second")
+    p.add_argument("--per-request", type=int, default=50)
+    p.add_argument("--seconds", type=float, default=10)
+    a = p.parse_args()
+    fake_sender(a.url, a.rate, a.per_request, a.seconds)
@@ -0,0 +1,4 @@
+# WhatsFlow Benchmarks
+# Offline load tests: seed a SQLite database of any size, drive a local server
+# with concurrent writers, /ws subscribers and readers, and compare the JSON
+# report against a stored baseline. See `python -m bench --help`.
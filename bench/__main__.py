@@ -0,0 +1,66 @@
+# python -m bench seed | run | compare  (see the module headers for details)
+from bench import report
+import argparse, json, os, sys
+
+def main(argv=None):
+    p = argparse.ArgumentParser(prog="python -m bench", description="WhatsFlow offline load tests")
+    sub = p.add_subparsers(dest="cmd", required=True)
+
+    s = sub.add_parser("seed", help="create a benchmark database")
+    s.add_argument("db")
+    s.add_argument("--messages", type=int, default=100_000)
+    s.add_argument("--senders", type=int, help="distinct contacts (default: messages / 40)")
+    s.add_argument("--days", type=float, default=30, help="history the timestamps span")
+    s.add_argument("--seed", type=int, default=1)
+
+    r = sub.add_parser("run", help="run a load mix against a copy of a seeded database")
+    r.add_argument("db")
+    r.add_argument("--duration", type=float, default=30, help="measured seconds")
+    r.add_argument("--warmup", type=float, default=3)
+    r.add_argument("--drain", type=float, default=2, help="seconds to wait for in-flight broadcasts after the load stops")
+    r.add_argument("--writers", type=int, default=4, help="concurrent POST /webhook clients")
+    r.add_argument("--per-request", type=int, default=10, help="messages per webhook payload")
+    r.add_argument("--simulators", type=int, default=1, help="concurrent POST /simulate clients")
+    r.add_argument("--subscribers", type=int, default=50, help="/ws dashboards")
+    r.add_argument("--searchers", type=int, default=2, help="concurrent search clients")
+    r.add_argument("--readers", type=int, default=2, help="concurrent /api/messages, /api/users, /api/stats clients")
+    r.add_argument("--workers", type=int, default=1, help="uvicorn workers (use with --backplane sqlite)")
+    r.add_argument("--backplane", default="memory", choices=["memory", "sqlite"])
+    r.add_argument("--in-process", action="store_true", help="serve from a thread in this process instead of a subprocess")
+    r.add_argument("--in-place", action="store_true", help="write to the database itself instead of a temporary copy")
+    r.add_argument("--seed", type=int, default=1)
+    r.add_argument("--out", help="write the JSON report here (default: stdout)")
+    r.add_argument("--baseline", help="compare against this report and exit 1 on a regression")
+    r.add_argument("--threshold", type=float, default=0.1)
+
+    c = sub.add_parser("compare", help="flag regressions of one report against another")
+    c.add_argument("baseline")
+    c.add_argument("current")
+    c.add_argument("--threshold", type=float, default=0.1, help="relative change that counts as a regression")
+    c.add_argument("--min-ms", type=float, default=1.0, help="ignore latency changes smaller than this")
+
+    a = p.parse_args(argv)
+    if a.cmd == "seed":
+        from bench.seed import seed
+        return seed(a.db, a.messages, a.senders, a.days, a.seed)
+    if a.cmd == "run":
+        if not os.path.exists(a.db): sys.exit(f"{a.db} not found; create it with `python -m bench seed {a.db}`")
+        from bench.load import run
+        result = run(a)
+        text = json.dumps(result, indent=2)
+        if a.out:
+            with open(a.out, "w") as f: f.write(text + "\n")
+        else: print(text)
+        if not a.baseline: return
+        baseline, current, threshold, min_ms = report.load(a.baseline), result, a.threshold, 1.0
+    else:
+        baseline, current, threshold, min_ms = report.load(a.baseline), report.load(a.current), a.threshold, a.min_ms
+    out = sys.stderr if a.cmd == "run" and not a.out else None
+    differ = report.config_diff(baseline, current)
+    if differ: print(f"warning: reports were made with different settings: {', '.join(differ)}", file=out)
+    rows = report.compare(baseline, current, threshold, min_ms)
+    report.print_comparison(rows, out=out)
+    if any(r["regression"] for r in rows): sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+# WhatsFlow Benchmarks - Load
+# Serves a copy of a seeded database (a local uvicorn subprocess, or a server
+# thread inside this process with --in-process) and runs a fixed-duration mix
+# of concurrent clients against it, all on loopback:
+#
+#   writers      POST /webhook, Cloud API payloads tagged with a marker
+#   simulators   POST /simulate
+#   subscribers  /ws dashboards; each marker's arrival gives the delivery lag
+#                (webhook accepted -> batched write -> backplane -> coalesced frame)
+#   searchers    GET /api/messages?search=
+#   readers      GET /api/messages, /api/users and /api/stats
+#
+#   python -m bench run bench.db [--duration 30] [--writers 4] [--subscribers 50] ... [--out report.json]
+from bench.report import summarize
+from bench.seed import WORDS, sender_weights
+import asyncio, bisect, datetime, json, os, platform, random, resource, shutil, socket, subprocess, sys, tempfile, threading, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def tree_hwm_mb(pid):
+    # Peak RSS (VmHWM) of a process and all of its descendants; Linux only.
+    try:
+        parents = {}
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit(): continue
+            try:
+                with open(f"/proc/{entry}/stat") as f: parents[int(entry)] = int(f.read().rsplit(")", 1)[1].split()[1])
+            except OSError: pass
+        pids, total = [pid], 0
+        for p in pids:
+            pids.extend(c for c, pp in parents.items() if pp == p)
+            try:
+                with open(f"/proc/{p}/status") as f:
+                    total += next(int(l.split()[1]) for l in f if l.startswith("VmHWM:"))
+            except (OSError, StopIteration): pass
+        return round(total / 1024, 1)
+    except OSError:
+        return None
+
+class Subprocess:
+    def __init__(self, db, port, workers=1, env=None):
+        self.url = f"http://127.0.0.1:{port}"
+        self.proc = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+             "--workers", str(workers), "--log-level", "warning"],
+            cwd=ROOT, env={**os.environ, **(env or {}), "WHATSFLOW_DB": db})
+
+    def peak_rss_mb(self):
+        return tree_hwm_mb(self.proc.pid)
+
+    def stop(self):
+        self.proc.terminate()
+        try: self.proc.wait(30)
+        except subprocess.TimeoutExpired: self.proc.kill()
+
+class InProcess:
+    # Shares the interpreter with the load generator, so numbers (RSS especially)
+    # include it; handy under a profiler.
+    def __init__(self, db, port, env=None):
+        import uvicorn
+        os.environ.update({**(env or {}), "WHATSFLOW_DB": db})
+        self.url = f"http://127.0.0.1:{port}"
+        self.server = uvicorn.Server(uvicorn.Config("app.main:app", host="127.0.0.1", port=port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+        self.thread.start()
+
+    def peak_rss_mb(self):
+        return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+    def stop(self):
+        self.server.should_exit = True
+        self.thread.join(30)
+
+async def wait_ready(client, server, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if getattr(server, "proc", None) and server.proc.poll() is not None: sys.exit("server exited during startup")
+        try:
+            if (await client.get("/api/stats")).status_code == 200: return
+        except Exception: pass
+        await asyncio.sleep(0.2)
+    sys.exit(f"server not ready after {timeout}s")
+
+class Load:
+    def __init__(self, url, args):
+        self.url, self.args = url, args
+        self.rng = random.Random(args.seed)
+        self.senders = sender_weights(10_000)
+        self.latency = {k: [] for k in ("webhook", "simulate", "search", "reads")}
+        self.errors = dict.fromkeys(self.latency, 0)
+        self.sent, self.lag, self.frames, self.truncated = {}, [], 0, 0
+        self.measuring = False
+        self.stop = asyncio.Event()
+
+    def record(self, kind, started, ok):
+        if not self.measuring: return
+        if ok: self.latency[kind].append((time.perf_counter() - started) * 1000)
+        else: self.errors[kind] += 1
+
+    async def writer(self, client, n):
+        i = 0
+        while not self.stop.is_set():
+            msgs, now = [], int(time.time())
+            for _ in range(self.args.per_request):
+                i += 1; marker = f"w{n}x{i}"
+                msgs.append({"from": f"49176{bisect.bisect(self.senders, self.rng.random() * self.senders[-1]):07d}", "id": f"wamid.{marker}", "timestamp": str(now),
+                             "type": "text", "text": {"body": f"bench {marker} {self.rng.choice(WORDS)}"}})
+            body = {"object": "whatsapp_business_account",
+                    "entry": [{"id": "0", "changes": [{"field": "messages", "value": {"messaging_product": "whatsapp", "messages": msgs}}]}]}
+            started = time.perf_counter()
+            if self.measuring:
+                for m in msgs: self.sent[m["id"][6:]] = started
+            try: ok = (await client.post("/webhook", json=body)).status_code == 200
+            except Exception: ok = False
+            self.record("webhook", started, ok)
+
+    async def simulator(self, client):
+        while not self.stop.is_set():
+            started = time.perf_counter()
+            try: ok = (await client.post("/simulate")).status_code == 200
+            except Exception: ok = False
+            self.record("simulate", started, ok)
+
+    async def searcher(self, client):
+        while not self.stop.is_set():
+            q = " ".join(self.rng.choice(WORDS)[:self.rng.randint(2, 6)] for _ in range(self.rng.randint(1, 2)))
+            started = time.perf_counter()
+            try: ok = (await client.get("/api/messages", params={"search": q, "limit": 50})).status_code == 200
+            except Exception: ok = False
+            self.record("search", started, ok)
+
+    async def reader(self, client):
+        paths = ["/api/messages?limit=50", "/api/users?limit=50", "/api/stats"]
+        while not self.stop.is_set():
+            started = time.perf_counter()
+            try: ok = (await client.get(self.rng.choice(paths))).status_code == 200
+            except Exception: ok = False
+            self.record("reads", started, ok)
+
+    async def subscriber(self, ready):
+        import websockets
+        async with websockets.connect(self.url.replace("http", "ws", 1) + "/ws", max_size=None, open_timeout=60) as ws:
+            await ws.recv()  # init snapshot
+            ready.release()
+            while True:
+                frame = json.loads(await ws.recv())
+                now = time.perf_counter()
+                self.frames += 1
+                self.truncated += frame.get("truncated", 0)  # a dashboard re-reads these from /api/messages
+                for m in frame.get("messages", ()):
+                    if m["text"].startswith("bench "):
+                        sent = self.sent.get(m["text"].split(" ", 2)[1])
+                        if sent is not None: self.lag.append((now - sent) * 1000)
+
+    async def run(self):
+        import httpx
+        a = self.args
+        limits = httpx.Limits(max_connections=a.writers + a.simulators + a.searchers + a.readers + 4)
+        async with httpx.AsyncClient(base_url=self.url, timeout=30, limits=limits) as client:
+            ready, subs = asyncio.Semaphore(0), []
+            for _ in range(a.subscribers):
+                subs.append(asyncio.create_task(self.subscriber(ready)))
+                waiter = asyncio.create_task(ready.acquire())
+                await asyncio.wait([subs[-1], waiter], return_when=asyncio.FIRST_COMPLETED)
+                if not waiter.done(): waiter.cancel(); subs[-1].result()  # raises why it failed to connect
+            tasks = [asyncio.create_task(c) for c in
+                     [self.writer(client, n) for n in range(a.writers)] + [self.simulator(client) for _ in range(a.simulators)] +
+                     [self.searcher(client) for _ in range(a.searchers)] + [self.reader(client) for _ in range(a.readers)]]
+            before = (await client.get("/api/stats")).json()
+            await asyncio.sleep(a.warmup)
+            self.measuring, started = True, time.perf_counter()
+            await asyncio.sleep(a.duration)
+            self.measuring, elapsed = False, time.perf_counter() - started
+            self.stop.set()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await asyncio.sleep(a.drain)  # let in-flight batches reach the subscribers
+            for t in subs: t.cancel()
+            dead = [r for r in await asyncio.gather(*subs, return_exceptions=True) if not isinstance(r, asyncio.CancelledError)]
+            after = (await client.get("/api/stats")).json()
+        results = {k: summarize(v, elapsed, self.errors[k]) for k, v in self.latency.items() if v or self.errors[k]}
+        if self.sent and a.subscribers:
+            lag = summarize(self.lag, elapsed)
+            lag.pop("errors"); lag.pop("throughput")
+            lag["delivered"] = round(len(self.lag) / (len(self.sent) * a.subscribers), 4)
+            results["broadcast_lag"] = lag
+        results["messages_stored"] = {"count": after["total"] - before["total"], "throughput": round((after["total"] - before["total"]) / (elapsed + a.warmup + a.drain), 1)}
+        results["ws"] = {"subscribers": a.subscribers, "frames": self.frames, "truncated_messages": self.truncated, "dropped_sockets": len(dead)}
+        return results
+
+def run(args):
+    with tempfile.TemporaryDirectory(prefix="whatsflow-bench-") as tmp:
+        db = args.db
+        if not args.in_place:
+            db = os.path.join(tmp, "bench.db")
+            shutil.copyfile(args.db, db)
+        env = {"WHATSFLOW_STATS_RECONCILE": "0", "WHATSFLOW_BACKPLANE": args.backplane, "WHATSFLOW_WEBHOOK_INSECURE": "1"}
+        port = free_port()
+        server = InProcess(db, port, env) if args.in_process else Subprocess(db, port, args.workers, env)
+        try:
+            async def main():
+                import httpx
+                async with httpx.AsyncClient(base_url=server.url) as c: await wait_ready(c, server)
+                return await Load(server.url, args).run()
+            results = asyncio.run(main())
+            results["peak_rss_mb"] = server.peak_rss_mb()
+        finally:
+            server.stop()
+    return {"meta": {"created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+                     "python": platform.python_version(), "platform": platform.platform(), "db": os.path.basename(args.db),
+                     "db_mb": round(os.path.getsize(args.db) / 2**20, 1), "server": "in-process" if args.in_process else "subprocess",
+                     **{k: getattr(args, k) for k in ("duration", "warmup", "drain", "writers", "per_request", "simulators", "subscribers",
+                                                      "searchers", "readers", "workers", "backplane", "seed")}},
+            "results": results}
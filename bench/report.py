@@ -0,0 +1,60 @@
+# WhatsFlow Benchmarks - Reports
+# Summaries of raw samples and the baseline comparison. Latencies are in ms.
+#
+#   python -m bench compare baseline.json current.json [--threshold 0.1]
+import json
+
+LOWER_IS_BETTER  = ("p50", "p95", "p99", "peak_rss_mb")
+HIGHER_IS_BETTER = ("throughput",)
+
+def percentile(sorted_values, p):
+    if not sorted_values: return None
+    k = (len(sorted_values) - 1) * p / 100
+    lo = int(k); hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+def summarize(samples, seconds, errors=0):
+    s = sorted(samples)
+    out = {"count": len(s), "errors": errors, "throughput": round(len(s) / seconds, 1) if seconds else 0}
+    for p in (50, 95, 99): out[f"p{p}"] = round(percentile(s, p), 2) if s else None
+    out["max"] = round(s[-1], 2) if s else None
+    return out
+
+def metrics(report):
+    # Flatten to {"webhook.p95": 12.3, ..., "peak_rss_mb": 80.1} for the comparable keys.
+    out = {}
+    for section, value in report["results"].items():
+        if isinstance(value, dict):
+            out.update({f"{section}.{k}": v for k, v in value.items() if k in LOWER_IS_BETTER + HIGHER_IS_BETTER and v is not None})
+        elif section in LOWER_IS_BETTER and value is not None:
+            out[section] = value
+    return out
+
+def compare(baseline, current, threshold=0.1, min_ms=1.0):
+    # One row per metric present in both reports; a regression is a change in
+    # the bad direction of more than `threshold` (relative) and, for
+    # latencies, more than `min_ms` (absolute) so sub-ms jitter isn't flagged.
+    base, cur, rows = metrics(baseline), metrics(current), []
+    for name in sorted(base.keys() & cur.keys()):
+        b, c = base[name], cur[name]
+        change = (c - b) / b if b else 0.0
+        kind = name.rsplit(".", 1)[-1]
+        worse = -change if kind in HIGHER_IS_BETTER else change
+        floor = min_ms if kind in ("p50", "p95", "p99") else 0
+        rows.append({"metric": name, "baseline": b, "current": c, "change": round(change, 4),
+                     "regression": worse > threshold and abs(c - b) > floor})
+    return rows
+
+def config_diff(baseline, current):
+    # Load settings that differ; numbers from different mixes don't compare.
+    skip = {"created", "python", "platform"}
+    b, c = baseline.get("meta", {}), current.get("meta", {})
+    return sorted(k for k in b.keys() | c.keys() if k not in skip and b.get(k) != c.get(k))
+
+def print_comparison(rows, out=None):
+    for r in rows:
+        flag = "REGRESSION" if r["regression"] else ""
+        print(f"{r['metric']:<28} {r['baseline']:>12} {r['current']:>12} {r['change']:>+8.1%}  {flag}", file=out)
+
+def load(path):
+    with open(path) as f: return json.load(f)
@@ -0,0 +1,79 @@
+# WhatsFlow Benchmarks - Seeding
+# Builds a database of any size (10k to 10M+ messages) with the shape of real
+# traffic: a long-tail sender distribution (a few busy contacts, many that
+# wrote once), inbound messages each followed by a bot reply, a sprinkling of
+# failed sends, and timestamps spread over the last --days. Rows go in through
+# bulk executemany with the search triggers dropped; the stats, activity and
+# search tables are rebuilt once at the end, exactly as their CLIs would.
+#
+#   python -m bench seed bench.db --messages 1000000 [--senders N] [--days 30] [--seed 1]
+import bisect, datetime, itertools, os, random, sys, time
+
+WORDS = ("hello hi thanks order delivery status refund invoice price help please when where tomorrow today "
+         "payment card address tracking cancel change update urgent question support appointment booking").split()
+REPLIES = ["Hi! How can I help?", "Thanks for reaching out 🙏", "Got it, we'll get back to you!",
+           "Our team will contact you shortly.", "Sure! Give me a moment."]
+CHUNK = 50_000
+TS_FORMAT = "%Y-%m-%d %H:%M:%S.%f"  # what SQLAlchemy's SQLite DateTime stores
+
+def phone(i):
+    return f"+49 176 {i:07d}"
+
+def sender_weights(n, skew=1.1):
+    # Zipf: sender k writes ~1/k^skew as often as the busiest one.
+    return list(itertools.accumulate(1 / (k ** skew) for k in range(1, n + 1)))
+
+def inbound_text(rng):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 8))).capitalize()
+
+def generate(messages, senders, days, rng, now=None):
+    # Yields (sender_index or None for the bot, text, status, timestamp) in time order.
+    now = now or datetime.datetime.utcnow()
+    cum, start = sender_weights(senders), now - datetime.timedelta(days=days)
+    step = datetime.timedelta(days=days) / max(messages, 1)
+    t = start
+    for i in range(messages):
+        t += step * rng.uniform(0.5, 1.5) if i else step
+        if i % 2 == 0:
+            who = bisect.bisect(cum, rng.random() * cum[-1])
+            yield who, inbound_text(rng), "received", t
+        else:
+            yield None, rng.choice(REPLIES), "failed" if rng.random() < 0.01 else "sent", t
+
+def seed(path, messages, senders=None, days=30, seed=1, out=sys.stdout):
+    # Fresh database at `path`; app modules read WHATSFLOW_DB at import time.
+    if os.path.exists(path): sys.exit(f"{path} already exists, refusing to overwrite")
+    os.environ["WHATSFLOW_DB"] = path
+    from app.db import engine, SessionLocal, create_schema
+    from app import stats, activity, search
+    senders = senders or max(100, messages // 40)
+    rng, began = random.Random(seed), time.monotonic()
+    create_schema()
+    users = {}
+    with engine.begin() as conn:
+        insert = "INSERT INTO messages (sender, text, status, timestamp) VALUES (?, ?, ?, ?)"
+        rows = []
+        for who, text, status, ts in generate(messages, senders, days, rng):
+            ts = ts.strftime(TS_FORMAT)
+            if who is None: sender = "Bot"
+            else:
+                sender = phone(who)
+                u = users.get(sender)
+                if u: u[1] = ts; u[2] += 1
+                else: users[sender] = [ts, ts, 1]
+            rows.append((sender, text, status, ts))
+            if len(rows) == CHUNK:
+                conn.exec_driver_sql(insert, rows); rows = []
+                print(f"\r{conn.exec_driver_sql('SELECT max(id) FROM messages').scalar():,} messages", end="", file=out, flush=True)
+        if rows: conn.exec_driver_sql(insert, rows)
+        conn.exec_driver_sql("INSERT INTO users (phone, first_seen, last_seen, message_count) VALUES (?, ?, ?, ?)",
+                             [(p, *u) for p, u in users.items()])
+    print(f"\r{messages:,} messages from {len(users):,} senders inserted, indexing...", file=out, flush=True)
+    db = SessionLocal()
+    try:
+        stats.rebuild(db); activity.backfill(db); db.commit()
+    finally:
+        db.close()
+    with engine.begin() as conn: search.rebuild(conn)
+    with engine.connect() as conn: conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+    print(f"seeded {path} in {time.monotonic() - began:.1f}s ({os.path.getsize(path) / 2**20:.0f} MiB)", file=out)
@@ -0,0 +1,31 @@
+# Every test module shares one throwaway database; app.db reads WHATSFLOW_DB
+# at import time, so it is set before anything from app is imported.
+import os, tempfile
+os.environ["WHATSFLOW_DB"] = os.path.join(tempfile.mkdtemp(prefix="whatsflow-tests-"), "test.db")
+
+import pytest
+from app.db import Base, SessionLocal, engine, create_schema
+from app import search
+
+def wipe():
+    with engine.begin() as conn:
+        for table in reversed(Base.metadata.sorted_tables): conn.execute(table.delete())
+
+@pytest.fixture
+def db():
+    # Empty on the way in too: importing app.main seeds the demo messages.
+    create_schema()
+    search.install()
+    wipe()
+    session = SessionLocal()
+    yield session
+    session.close()
+    wipe()
+
+@pytest.fixture(scope="session")
+def client():
+    # One app lifespan for the whole run: the ingestor and bot queues belong to
+    # the event loop they were first used on.
+    from fastapi.testclient import TestClient
+    from app.main import app
+    with TestClient(app) as c: yield c
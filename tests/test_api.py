@@ -0,0 +1,103 @@
+from sqlalchemy import func
+from app.db import Message
+from app import main
+import csv, datetime, io, json, pytest, time
+
+def until_bot_reply(ws):
+    # Frames up to the one carrying the bot's reply (bursts may be coalesced).
+    out = []
+    while not any(m["from"] == "Bot" for f in out for m in f.get("messages", ())): out.append(ws.receive_json())
+    return out
+
+@pytest.mark.parametrize("push", [True, False])
+def test_init_frames_say_whether_users_are_pushed(client, db, monkeypatch, push):
+    monkeypatch.setattr(main, "USERS_PUSH", push)
+    with client.websocket_connect("/ws") as ws:
+        init = ws.receive_json()
+        assert init["type"] == "init" and init["users_push"] is push
+        client.post("/simulate")
+        until_bot_reply(ws)
+    # A bot reply touches no user, so it carries none even with push on; the
+    # dashboard only refetches /api/users when init said push is off.
+    inbound, reply = [e for e in main.events.log if e["seq"] > init["seq"]]
+    assert ("users" in inbound) is push and reply["messages"][0]["from"] == "Bot" and "users" not in reply
+    assert "else if(!usersPush)loadUsers()" in main.HTML
+
+@pytest.fixture
+def tokyo_server(monkeypatch):
+    # A server clock far from UTC, where local-time defaults show up.
+    monkeypatch.setenv("TZ", "Asia/Tokyo"); time.tzset()
+    yield
+    monkeypatch.undo(); time.tzset()
+
+def test_activity_default_window_matches_an_explicit_utc_range(client, db, tokyo_server):
+    # Stored timestamps are naive UTC; messages either side of an hour boundary
+    # land in their own buckets whichever way the window is given.
+    now = datetime.datetime.utcnow()
+    hour = now.replace(minute=0, second=0, microsecond=0)
+    tick = datetime.timedelta(microseconds=1)
+    stamps = [hour - tick, hour, hour, hour - datetime.timedelta(hours=5), hour - datetime.timedelta(hours=5) - tick]
+    db.add_all([Message(sender="+1", text="x", status="received", timestamp=t) for t in stamps]); db.commit()
+    tokyo = datetime.timezone(datetime.timedelta(hours=9))
+    explicit = client.get("/api/activity", params={"from": (now - datetime.timedelta(hours=24)).replace(tzinfo=datetime.timezone.utc).astimezone(tokyo).isoformat(),
+                                                   "to": now.replace(tzinfo=datetime.timezone.utc).isoformat()}).json()
+    default = client.get("/api/activity").json()
+    assert default == explicit and len(default) in (24, 25)
+    counts = {b["bucket"]: b["count"] for b in default}
+    assert counts[hour.isoformat()] == 2 and counts[(hour - datetime.timedelta(hours=1)).isoformat()] == 1
+    for b in default:  # the rollup agrees with counting the [bucket, bucket + 1h) range directly
+        start = datetime.datetime.fromisoformat(b["bucket"])
+        live = db.scalar(func.count(Message.id).select().where(Message.timestamp >= start, Message.timestamp < start + datetime.timedelta(hours=1)))
+        assert b["count"] == live, b
+
+def add_messages(db, stamps):
+    rows = [Message(sender="+1", text=f"m{i}", status="received", timestamp=t) for i, t in enumerate(stamps)]
+    db.add_all(rows); db.commit()
+    return [m.id for m in rows]
+
+def test_keyset_paging_is_stable_on_equal_timestamps(client, db):
+    t = datetime.datetime(2026, 1, 1, 12)
+    # Ids out of timestamp order, and a run of four sharing one timestamp.
+    ids = add_messages(db, [t + datetime.timedelta(minutes=5), t, t, t, t, t - datetime.timedelta(minutes=5)])
+    order = [ids[5], ids[1], ids[2], ids[3], ids[4], ids[0]]  # by (timestamp, id)
+    page = lambda **p: [m["id"] for m in client.get("/api/messages", params=p).json()]
+    assert page(limit=10) == order
+    assert page(limit=2) == order[-2:]
+    assert page(limit=2, before=order[-2]) == order[2:4]
+    assert page(limit=2, before=order[2]) == order[:2]
+    assert page(limit=2, before=order[0]) == []
+    assert page(limit=3, after=order[1]) == order[2:5]
+    assert page(limit=3, after=order[-1]) == []
+    seen, cursor = [], order[0]
+    while batch := page(limit=2, after=cursor): seen += batch; cursor = batch[-1]
+    assert [order[0]] + seen == order
+
+def test_paging_rejects_bad_anchors(client, db):
+    (only,) = add_messages(db, [datetime.datetime(2026, 1, 1)])
+    assert client.get("/api/messages", params={"before": only + 100}).status_code == 404
+    assert client.get("/api/messages", params={"after": only + 100}).status_code == 404
+    assert client.get("/api/messages", params={"before": only, "after": only}).status_code == 400
+    assert client.get("/api/messages", params={"before": only, "search": "m"}).status_code == 400
+
+def test_export_streams_csv_and_ndjson_within_the_range(client, db):
+    t = datetime.datetime(2026, 1, 1, 12)
+    ids = add_messages(db, [t - datetime.timedelta(seconds=1), t, t + datetime.timedelta(hours=1), t + datetime.timedelta(hours=2)])
+    db.query(Message).filter(Message.id == ids[1]).update({"text": 'comma, "quote"\nnewline'}); db.commit()
+    window = {"from": "2026-01-01T12:00:00", "to": "2026-01-01T14:00:00+01:00"}  # [12:00, 13:00 UTC)
+    r = client.get("/api/messages/export", params={"format": "ndjson", **window})
+    assert r.headers["content-type"].startswith("application/x-ndjson")
+    assert [json.loads(l) for l in r.text.splitlines()] == [
+        {"id": ids[1], "from": "+1", "text": 'comma, "quote"\nnewline', "status": "received", "timestamp": "2026-01-01T12:00:00"}]
+    r = client.get("/api/messages/export", params={"format": "csv", "from": "2026-01-01T12:00:00"})
+    assert r.headers["content-type"].startswith("text/csv") and "whatsflow-messages.csv" in r.headers["content-disposition"]
+    rows = list(csv.reader(io.StringIO(r.text)))
+    assert rows[0] == main.EXPORT_FIELDS and [int(row[0]) for row in rows[1:]] == ids[1:]
+    assert rows[1][2] == 'comma, "quote"\nnewline'
+    everything = client.get("/api/messages/export").text.splitlines()
+    assert [json.loads(l)["id"] for l in everything] == ids
+    assert client.get("/api/messages/export", params={"format": "xml"}).status_code == 422
+
+def test_export_spans_several_chunks(client, db, monkeypatch):
+    monkeypatch.setattr(main, "EXPORT_CHUNK", 2)
+    ids = add_messages(db, [datetime.datetime(2026, 1, 1, 12, m) for m in range(5)])
+    assert [json.loads(l)["id"] for l in client.get("/api/messages/export").text.splitlines()] == ids
@@ -0,0 +1,29 @@
+from app.backplane import SQLiteBackplane
+from app import stats
+import asyncio
+
+def run(coro):
+    return asyncio.run(coro)
+
+async def feed(events, published=()):
+    got = []
+    bp = SQLiteBackplane(poll_ms=5)
+    await bp.start(lambda seq, event: got.append((seq, event)))
+    for e in published: await bp.publish(e)
+    while len(got) < len(published): await asyncio.sleep(0.005)
+    await bp.stop()
+    events.extend(got)
+    return bp
+
+def test_events_arrive_once_in_seq_order(db):
+    got = []
+    bp = run(feed(got, [{"n": 1}, {"n": 2}, {"n": 3}]))
+    assert [e["n"] for _, e in got] == [1, 2, 3]
+    assert [s for s, _ in got] == sorted(s for s, _ in got) and bp.seq == got[-1][0]
+    again = run(feed([]))
+    assert (again.epoch, again.seq) == (bp.epoch, bp.seq)  # a restart resumes the same feed
+
+def test_the_feed_epoch_is_not_a_stats_counter(db):
+    epoch = run(feed([])).epoch
+    stats.reset_messages(db); db.query(stats.Counter).delete(); db.commit()
+    assert run(feed([])).epoch == epoch
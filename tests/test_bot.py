@@ -0,0 +1,92 @@
+from app import bot
+import os, random, pytest
+
+RULES = {"default": "fallback", "rules": [
+    {"name": "order", "regex": r"\border\s*#?\s*(?P<order>\d{3,})", "set": {"order": "{order}"}, "reply": "order {order}"},
+    {"name": "followup", "keywords": ["any updates", "status"], "when": {"order": "*"}, "reply": "still {order}"},
+    {"name": "again", "keywords": ["hi"], "when": {"greeted": True}, "reply": "welcome back"},
+    {"name": "greeting", "keywords": ["hi", "good morning"], "set": {"greeted": True}, "reply": "hello {sender}"},
+    {"name": "zip", "regex": r"\b\d{5}\b", "reply": "zip"},
+    {"name": "status", "keywords": ["status"], "reply": "what status?"}]}
+
+def test_first_rule_in_file_order_wins():
+    rules = bot.Rules(RULES)
+    assert rules.match("hi, order 123 please", {}).name == "order"
+    assert rules.match("Good morning, zip 10115", {}).name == "greeting"
+    assert rules.match("ship to 10115", {}).name == "zip"
+    assert rules.match("status?", {}).name == "status"
+    assert rules.match("status?", {"order": "123"}).name == "followup"
+    assert rules.match("nothing here", {}) is None
+
+def test_a_conversation_carries_state():
+    rules, state = bot.Rules(RULES), {}
+    assert rules.reply("+1", "hi", state) == ("greeting", "hello +1")
+    assert rules.reply("+1", "hi", state) == ("again", "welcome back")
+    assert rules.reply("+1", "where is ORDER #4711", state) == ("order", "order 4711")
+    assert rules.reply("+1", "any updates?", state) == ("followup", "still 4711")
+    assert state == {"greeted": True, "order": "4711"}
+    assert rules.reply("+1", "meh", state) == (None, "fallback")
+
+def test_rules_are_validated():
+    for spec in ({"reply": "x"}, {"keywords": ["a"]}):
+        with pytest.raises(ValueError): bot.Rules({"rules": [spec]})
+
+@pytest.mark.parametrize("pattern, literals", [
+    (r"\border\s*#?(\d+)", ["order"]),
+    (r"(?:refund|return)s? please", [" please"]),
+    (r"(refund|return) \d+", ["fund", "turn"]),  # the parser factors out the common "re"
+    (r"(refund|cancel) \d+", ["refund", "cancel"]),
+    (r"(ab|c)x", None),            # "c" is shorter than the minimum
+    (r"\d{5}", None),
+    (r"(?:colou?r)*", None),       # may repeat zero times
+    (r"Hello", ["hello"]),
+    (r"[", None),
+])
+def test_required_literals(pattern, literals):
+    assert bot.required(pattern) == literals
+
+def test_a_broken_parser_only_makes_rules_loose(monkeypatch):
+    # required() reads the private regex parser; if that changes shape the
+    # rules still load and match, just without the literal index.
+    def parse(*a): raise AttributeError("parser changed")
+    monkeypatch.setattr(bot.sre, "parse", parse)
+    assert bot.required(r"order (\d+)") is None
+    rules = bot.Rules(RULES)
+    assert rules.loose == [0, 4]
+    assert rules.match("order 123", {}).name == "order" and rules.match("ship to 10115", {}).name == "zip"
+
+def test_odd_parse_trees_only_make_rules_loose(monkeypatch):
+    monkeypatch.setattr(bot.sre, "parse", lambda *a: [(bot.sre.LITERAL, "not a code point")])
+    assert bot.required("x") is None
+
+def test_automaton_finds_overlapping_words():
+    a = bot.Automaton({"he": [0], "she": [1], "hers": [2], "his": [3], "s": [4]})
+    assert a.scan("ushers") == {0, 1, 2, 4}
+    assert a.scan("this") == {3, 4} and a.scan("") == set()
+
+def test_matching_agrees_with_trying_every_rule():
+    rng = random.Random(7)
+    words = ["order", "refund", "hi", "status", "any", "updates", "#", "123", "4711", "10115", "please", "zip"]
+    spec = {"rules": [{"keywords": [" ".join(rng.sample(words, rng.randint(1, 2)))], "reply": "k"} for _ in range(30)] +
+                     [{"regex": p, "reply": "r"} for p in (r"order\s*#?\d+", r"(refund|status) \d+", r"\d{5}", r"zip|please")]}
+    rng.shuffle(spec["rules"])
+    rules = bot.Rules(spec)
+    def naive(text):
+        words_in = bot.tokens(text)
+        for r in rules.rules:
+            if any(words_in[i:i + len(k)] == list(k) for k in r.keywords for i in range(len(words_in))): return r
+            if r.regex and r.regex.search(text): return r
+    for _ in range(500):
+        text = " ".join(rng.choice(words) for _ in range(rng.randint(1, 6)))
+        text = text.upper() if rng.random() < 0.2 else text
+        assert rules.match(text, {}) is naive(text), text
+
+def test_contexts_keep_the_most_recent_senders():
+    ctx = bot.Contexts(2)
+    ctx.get_state("a")["n"] = 1
+    ctx.get_state("b"); ctx.get_state("a"); ctx.get_state("c")
+    assert list(ctx) == ["a", "c"] and ctx.get_state("a") == {"n": 1}
+
+def test_the_shipped_rules_load():
+    rules = bot.load(os.path.join(os.path.dirname(bot.__file__), "rules.json"))
+    assert rules.match("Where is order #12345?", {}).name == "order_status"
@@ -0,0 +1,121 @@
+from app.events import EventLog
+import asyncio, json
+
+def msg(n):
+    return {"id": n, "text": f"m{n}"}
+
+def update(*ids, stats=None, users=()):
+    e = {"type": "update", "messages": [msg(n) for n in ids], "users": [{"phone": p, "messages": c} for p, c in users]}
+    if stats is not None: e["stats"] = stats
+    return e
+
+def make(**kw):
+    published = []
+    return EventLog(published.append, epoch="e1", **{"interval_ms": 0, **kw}), published
+
+def in_loop(fn):
+    # append() arms the coalescing timer on the running loop.
+    async def go():
+        result = fn()
+        await asyncio.sleep(0.01)
+        return result
+    return asyncio.run(go())
+
+class Client:
+    # The dashboard's rules: skip frames it has, resync on a gap, else apply.
+    def __init__(self):
+        self.seq, self.ids, self.resync = None, [], False
+
+    def receive(self, frame):
+        if frame["type"] == "init":
+            self.seq, self.ids = frame["seq"], [m["id"] for m in frame["messages"]]
+        elif frame["seq"] <= self.seq: return
+        elif frame["base"] > self.seq: self.resync = True
+        else:
+            self.seq = frame["seq"]
+            self.ids += [m["id"] for m in frame["messages"] if m["id"] not in self.ids]
+
+def test_seqs_are_assigned_and_replays_dropped():
+    log, _ = make()
+    def run():
+        assert [log.append(update(n))["seq"] for n in (1, 2)] == [1, 2]
+        assert log.append(update(9), seq=7)["seq"] == 7  # backplane seqs may jump
+        assert log.append(update(9), seq=7) is None and log.append(update(9), seq=3) is None
+        assert log.append(update(10))["seq"] == 8
+    in_loop(run)
+    assert [e["seq"] for e in log.log] == [1, 2, 7, 8]
+
+def test_updates_carry_only_the_counters_that_moved():
+    log, _ = make()
+    def run():
+        log.append({"type": "init", "messages": [], "stats": {"total": 1, "users": 1}})
+        assert log.append(update(2, stats={"total": 2, "users": 1}))["stats"] == {"total": 2}
+        assert log.append(update(3, stats={"total": 2, "users": 1}))["stats"] == {}
+        assert log.append({"type": "init", "messages": [], "stats": {"total": 0, "users": 1}})["stats"] == {"total": 0, "users": 1}
+        assert log.append(update(4, stats={"total": 1, "users": 1}))["stats"] == {"total": 1}
+    in_loop(run)
+
+def test_a_burst_is_coalesced_into_one_frame():
+    log, published = make()
+    in_loop(lambda: [log.append(update(n, stats={"total": n}, users=[("+1", n)])) for n in (1, 2, 3)])
+    (frame,) = [json.loads(p) for p in published]
+    assert frame == {"type": "update", "base": 0, "seq": 3, "messages": [msg(1), msg(2), msg(3)],
+                     "stats": {"total": 3}, "users": [{"phone": "+1", "messages": 3}]}
+
+def test_an_init_supersedes_earlier_events():
+    log, _ = make()
+    events = [dict(update(n), seq=n) for n in (1, 2)] + [{"type": "init", "seq": 3, "messages": []}] + [dict(update(4), seq=4)]
+    init, rest = log.frames(events)
+    assert (init["type"], init["seq"], init["epoch"]) == ("init", 3, "e1")
+    assert (rest["base"], rest["seq"], rest["messages"]) == (3, 4, [msg(4)])
+
+def test_frames_keep_only_the_newest_messages():
+    log, _ = make(max_messages=2)
+    (frame,) = log.frames([dict(update(n), seq=n) for n in (1, 2, 3)])
+    assert frame["messages"] == [msg(2), msg(3)] and (frame["base"], frame["seq"]) == (0, 3)
+    assert frame["truncated"] == 1  # so the client knows to re-read /api/messages
+    assert "truncated" not in log.frames([dict(update(n), seq=n) for n in (1, 2)])[0]
+
+def test_since_replays_the_gap_or_gives_up():
+    log, _ = make(size=4)
+    in_loop(lambda: [log.append(update(n)) for n in range(1, 7)])  # buffer holds seqs 3..6
+    assert log.since("e1.6") == []
+    (frame,) = log.since("e1.4")
+    assert (frame["base"], frame["seq"], [m["id"] for m in frame["messages"]]) == (4, 6, [5, 6])
+    assert log.since("e1.2")[0]["base"] == 2  # seq 3 is the oldest kept, so 2 is still resumable
+    for cursor in ("e1.1", "e1.0", "e1.7", "e2.4", "e1", "e1.x", None):
+        assert log.since(cursor) is None, cursor
+
+def test_snapshot_plus_replay_misses_nothing():
+    # /ws reads a snapshot at seq s while writes keep landing; the events after s
+    # are replayed behind it, and live frames from then on continue seamlessly.
+    log, published = make()
+    async def go():
+        for n in (1, 2): log.append(update(n))
+        await asyncio.sleep(0.01)
+        s, snapshot = log.seq, {"type": "init", "epoch": log.epoch, "seq": log.seq, "messages": [msg(1), msg(2)]}
+        for n in (3, 4): log.append(update(n))  # committed while the snapshot was being read
+        frames = [snapshot] + (log.since(f"{log.epoch}.{s}") or [])
+        await asyncio.sleep(0.01)
+        live_from = len(published)
+        log.append(update(5))
+        await asyncio.sleep(0.01)
+        return frames + [json.loads(p) for p in published[live_from:]], [json.loads(p) for p in published]
+    frames, everything = asyncio.run(go())
+    client = Client()
+    for f in frames + everything: client.receive(f)  # stale and duplicate frames are harmless
+    assert (client.seq, client.ids, client.resync) == (5, [1, 2, 3, 4, 5], False)
+
+def test_a_client_that_missed_a_frame_resyncs():
+    log, published = make()
+    async def go():
+        log.append(update(1)); await asyncio.sleep(0.01)
+        log.append(update(2)); await asyncio.sleep(0.01)
+        log.append(update(3)); await asyncio.sleep(0.01)
+    asyncio.run(go())
+    client = Client()
+    client.receive({"type": "init", "seq": 1, "messages": [msg(1)]})
+    client.receive(json.loads(published[2]))
+    assert client.resync and client.seq == 1
+    for f in log.since("e1.1"): client.receive(f)
+    assert client.ids == [1, 2, 3]
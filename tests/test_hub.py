@@ -0,0 +1,121 @@
+from starlette.websockets import WebSocketDisconnect
+from app.hub import Hub, PING
+from app import metrics
+import asyncio, pytest
+
+class FakeSocket:
+    # Records what was sent; `stall` blocks send_text until set, `fail` makes it raise.
+    def __init__(self, stall=None, fail=None):
+        self.sent, self.stall, self.fail, self.closed = [], stall, fail, False
+        self.inbox = asyncio.Queue()
+
+    async def send_text(self, data):
+        if self.fail: raise self.fail
+        if self.stall: await self.stall.wait()
+        self.sent.append(data)
+
+    async def receive(self):
+        message = await self.inbox.get()
+        if isinstance(message, Exception): raise message
+        return message
+
+    def hang_up(self, how={"type": "websocket.disconnect", "code": 1001}):
+        self.inbox.put_nowait(how)
+
+    async def close(self):
+        self.closed = True
+
+def run(coro):
+    return asyncio.run(asyncio.wait_for(coro, 5))
+
+async def settle():
+    await asyncio.sleep(0.02)
+
+def evictions(reason):
+    return metrics.ws_evictions.collect().get((reason,), 0)
+
+def test_frames_are_encoded_once_and_reach_every_client():
+    async def go():
+        hub, a, b = Hub(), FakeSocket(), FakeSocket()
+        served = [asyncio.create_task(hub.serve(ws, "hello")) for ws in (a, b)]
+        await settle()
+        hub.publish({"type": "update", "seq": 1})
+        await settle()
+        assert len(hub) == 2
+        a.hang_up(); b.hang_up()
+        await asyncio.gather(*served)
+        return a, b
+    a, b = run(go())
+    assert a.sent == b.sent == ["hello", '{"type": "update", "seq": 1}'] and a.sent[1] is b.sent[1]
+
+async def slow_client(policy, published):
+    # The first frame is stuck in send_text while `published` arrive.
+    hub, release = Hub(maxsize=3, policy=policy), asyncio.Event()
+    ws = FakeSocket(stall=release)
+    served = asyncio.create_task(hub.serve(ws, "0"))
+    await settle()
+    client = next(iter(hub.clients))
+    for frame in published: hub.publish(frame)
+    release.set()
+    await settle()
+    ws.hang_up()
+    await served
+    return hub, ws, client
+
+@pytest.mark.parametrize("policy, delivered, dropped", [
+    ("drop_oldest", ["0", "3", "4", "5"], 2),
+    ("coalesce",    ["0", "4", "5"],      3),
+])
+def test_a_full_queue_drops_frames_by_policy(policy, delivered, dropped):
+    hub, ws, client = run(slow_client(policy, ["1", "2", "3", "4", "5"]))
+    assert ws.sent == delivered and client.dropped == dropped
+
+def test_a_full_queue_disconnects_under_the_disconnect_policy():
+    before = evictions("slow consumer")
+    hub, ws, client = run(slow_client("disconnect", ["1", "2", "3", "4"]))
+    assert ws.sent == ["0"] and ws.closed and client.closed and len(hub) == 0
+    assert evictions("slow consumer") == before + 1
+
+def test_a_stalled_send_is_evicted():
+    async def go():
+        hub, stuck, ok = Hub(send_timeout=0.05), FakeSocket(stall=asyncio.Event()), FakeSocket()
+        stuck_served, ok_served = asyncio.create_task(hub.serve(stuck, "init")), asyncio.create_task(hub.serve(ok, "init"))
+        await stuck_served  # returns on its own once the send times out
+        hub.publish("after")
+        await settle()
+        assert list(hub.clients)[0].ws is ok
+        ok.hang_up(); await ok_served
+        return hub, stuck, ok
+    before = evictions("send failed")
+    hub, stuck, ok = run(go())
+    assert stuck.closed and stuck.sent == [] and ok.sent == ["init", "after"] and len(hub) == 0
+    assert evictions("send failed") == before + 1
+
+def test_a_failing_send_is_evicted():
+    hub, ws = Hub(), FakeSocket(fail=RuntimeError("socket gone"))
+    run(hub.serve(ws, "init"))
+    assert ws.closed and len(hub) == 0
+
+def test_an_idle_socket_gets_heartbeats():
+    async def go():
+        hub, ws = Hub(heartbeat=0.02), FakeSocket()
+        served = asyncio.create_task(hub.serve(ws))
+        await asyncio.sleep(0.1)
+        ws.hang_up(); await served
+        return ws
+    sent = run(go()).sent
+    assert len(sent) >= 2 and set(sent) == {PING}
+
+@pytest.mark.parametrize("how", [{"type": "websocket.disconnect", "code": 1006}, WebSocketDisconnect(1006), RuntimeError("closed")])
+def test_a_closed_socket_is_noticed_by_the_read_loop(how):
+    async def go():
+        hub, ws = Hub(heartbeat=60), FakeSocket()
+        served = asyncio.create_task(hub.serve(ws))
+        await settle()
+        assert len(hub) == 1
+        ws.hang_up(how)
+        await served  # without the read loop this would wait a full heartbeat
+        hub.publish("late")
+        return hub, ws
+    hub, ws = run(go())
+    assert len(hub) == 0 and ws.closed and ws.sent == []
@@ -0,0 +1,79 @@
+from sqlalchemy import text
+from app.db import SessionLocal, run_read
+from app import metrics
+import asyncio, logging, re
+
+SAMPLE = re.compile(r'([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{((?:[a-zA-Z_]\w*="(?:[^"\\\n]|\\[\\"n])*",?)*)\})? (\S+)')
+LABEL  = re.compile(r'([a-zA-Z_]\w*)="((?:[^"\\]|\\.)*)"')
+
+def samples(body):
+    # (name, labels, value) for every sample; every other line must be HELP/TYPE.
+    out = []
+    for line in body.splitlines():
+        if line.startswith("# "):
+            assert re.fullmatch(r"# (HELP \S+ .+|TYPE \S+ (counter|gauge|histogram|untyped))", line), line
+            continue
+        m = SAMPLE.fullmatch(line)
+        assert m, line
+        out.append((m[1], dict(LABEL.findall(m[2] or "")), float(m[3])))
+    return out
+
+def test_metrics_are_valid_exposition_format(client, db):
+    for path in ("/api/stats", "/api/users", "/api/messages?limit=5"): client.get(path)
+    r = client.get("/metrics")
+    assert r.headers["content-type"].startswith("text/plain; version=0.0.4")
+    found = samples(r.text)
+    checked = 0
+    for name in [m.name for m in metrics.REGISTRY if m.kind == "histogram"]:
+        series = {}
+        for n, labels, value in found:
+            if n == name + "_bucket": series.setdefault(tuple(sorted((k, v) for k, v in labels.items() if k != "le")), []).append((labels["le"], value))
+        for key, buckets in series.items():
+            assert buckets[-1][0] == "+Inf" and [v for _, v in buckets] == sorted(v for _, v in buckets), (name, key)  # cumulative
+            (count,) = [v for n, labels, v in found if n == name + "_count" and tuple(sorted(labels.items())) == key]
+            assert count == buckets[-1][1]
+            checked += 1
+    assert checked >= 2
+    assert ("whatsflow_http_request_duration_seconds_count", {"method": "GET", "route": "/api/stats", "status": "2xx"}) in [(n, l) for n, l, _ in found]
+
+def test_label_values_are_escaped():
+    c = metrics.Counter("whatsflow_test_escaping_total", "test", ("path",))
+    try:
+        c.inc('a"b\\c\nd')
+        (line,) = [l for l in c.render() if not l.startswith("#")]
+        assert line == r'whatsflow_test_escaping_total{path="a\"b\\c\nd"} 1'
+        assert samples(line)
+    finally:
+        metrics.REGISTRY.remove(c)
+
+def queries(method, route):
+    return metrics.http_queries.collect().get((method, route), 0)
+
+def test_queries_are_counted_against_the_route_that_ran_them(client, db):
+    before = {k: queries(*k) for k in [("GET", "/api/stats"), ("POST", "/simulate"), ("GET", "/metrics")]}
+    client.get("/api/stats")     # sync handler: runs in the threadpool
+    client.post("/simulate")     # async handler: its writes go through run_write
+    client.get("/metrics")       # runs no SQL
+    assert queries("GET", "/api/stats") > before[("GET", "/api/stats")]
+    assert queries("POST", "/simulate") > before[("POST", "/simulate")]
+    assert queries("GET", "/metrics") == before[("GET", "/metrics")]
+
+def test_run_read_carries_the_request_tally():
+    def select_one():
+        db = SessionLocal()
+        try: return db.execute(text("SELECT 1")).scalar()
+        finally: db.close()
+    async def go():
+        tally = metrics.Tally()
+        token = metrics._tally.set(tally)
+        try: await run_read(select_one); await run_read(select_one)
+        finally: metrics._tally.reset(token)
+        return tally
+    tally = asyncio.run(go())
+    assert tally.queries == 2 and tally.db_seconds > 0
+
+def test_slow_requests_are_logged_with_their_queries(client, db, monkeypatch, caplog):
+    monkeypatch.setattr(metrics, "SLOW_MS", 1e-9)
+    with caplog.at_level(logging.WARNING, "whatsflow.metrics"): client.get("/api/stats?x=1")
+    (record,) = [r for r in caplog.records if "slow request" in r.getMessage()]
+    assert "GET /api/stats?x=1 -> 200" in record.getMessage() and "SELECT" in record.getMessage()
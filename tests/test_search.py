@@ -0,0 +1,43 @@
+from app.db import Message
+from app import search
+import pytest, re
+
+def test_words_become_quoted_prefix_terms():
+    assert search.match_expr("order status") == '{text sender} : ("order"* AND "status"*)'
+
+def test_blank_input_matches_nothing():
+    assert search.match_expr("") is None
+    assert search.match_expr("  -- ") is None
+
+@pytest.mark.parametrize("raw", ['"', 'a" OR "b', "NEAR(a b)", "text:x", "^start", "a*", "(x", "NOT x", "a AND", "{sender}: 1"])
+def test_fts_syntax_in_input_cannot_break_the_query(db, raw):
+    search.query(db, raw)  # an FTS5 syntax error would raise here
+    expr = search.match_expr(raw)
+    # Only \w+ runs reach the expression, each as its own quoted term.
+    terms = len(re.findall(r"\w+", raw)) + ("sender_digits" in (expr or ""))
+    assert expr is None or expr.count('"') == 2 * terms
+
+def test_phone_like_input_also_searches_digits():
+    expr = search.match_expr("+49 176-12")
+    assert expr.endswith('OR sender_digits : "4917612"*')
+    assert "sender_digits" not in search.match_expr("order 12")
+
+def test_query_finds_text_and_formatted_phone_prefixes(db):
+    db.add_all([Message(sender="+49 176 1234567", text="Where is my order?"),
+                Message(sender="+49 152 9876543", text="Thanks a lot"),
+                Message(sender="Bot", text="Your order shipped")])
+    db.commit()
+    hits = lambda q: sorted(m.text for m in search.query(db, q)[0])
+    assert hits("ord") == ["Where is my order?", "Your order shipped"]
+    assert hits("4917612") == hits("+49 176 12") == ["Where is my order?"]
+    assert hits('order" OR "thanks') == []  # quotes are dropped, not an OR
+
+def test_recent_pages_are_newest_first_and_complete(db):
+    db.add_all([Message(sender="+1", text=f"hello {i}") for i in range(7)])
+    db.commit()
+    seen, cursor = [], None
+    while True:
+        page, cursor = search.query(db, "hello", limit=3, cursor=cursor)
+        seen += [m.id for m in page]
+        if cursor is None: break
+    assert seen == sorted(seen, reverse=True) and len(seen) == 7
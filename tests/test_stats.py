@@ -0,0 +1,44 @@
+from app.db import SessionLocal, Message, User
+from app import stats
+import datetime, threading
+
+def test_counters_follow_session_writes(db):
+    now = datetime.datetime.utcnow()
+    db.add(User(phone="+1", first_seen=now, last_seen=now, message_count=2))
+    db.add_all([Message(sender="+1", text="a", status="received", timestamp=now),
+                Message(sender="Bot", text="b", status="sent", timestamp=now)])
+    db.commit()
+    assert stats.read(db) == stats.count_all(db) == {"total": 2, "received": 1, "sent": 1, "failed": 0, "users": 1}
+    db.query(Message).filter_by(sender="Bot").one().status = "failed"; db.commit()
+    assert stats.read(db) == stats.count_all(db)
+
+def test_clearing_messages_keeps_users_and_versions(db):
+    now = datetime.datetime.utcnow()
+    db.add(User(phone="+1", first_seen=now, last_seen=now, message_count=1))
+    db.add(Message(sender="+1", text="a", status="received", timestamp=now))
+    db.commit()
+    version = stats.version(db)
+    assert version > 0
+    db.query(Message).delete()
+    stats.reset_messages(db)
+    db.commit()
+    assert stats.read(db) == {"total": 0, "received": 0, "sent": 0, "failed": 0, "users": 1}
+    assert stats.version(db) == version
+
+def test_reconcile_does_not_lose_writes_committed_while_it_counts(db, monkeypatch):
+    # Another worker stores a message while this one recounts on startup.
+    def store():
+        other = SessionLocal()
+        other.add(Message(sender="+2", text="b", status="received", timestamp=datetime.datetime.utcnow())); other.commit()
+        other.close()
+    count_all = stats.count_all
+    def counting(db):
+        counts = count_all(db)
+        writer.start(); writer.join(0.3)
+        return counts
+    writer = threading.Thread(target=store)
+    db.add(Message(sender="+1", text="a", status="received", timestamp=datetime.datetime.utcnow())); db.commit()
+    monkeypatch.setattr(stats, "count_all", counting)
+    stats.reconcile()
+    writer.join()
+    assert stats.read(db) == count_all(db) and count_all(db)["total"] == 2
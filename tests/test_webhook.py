@@ -0,0 +1,84 @@
+from sqlalchemy.exc import OperationalError
+from app.db import Message, User
+from app import stats, activity, webhook
+import asyncio, datetime, hashlib, hmac
+
+def payload(*messages):
+    return {"object": "whatsapp_business_account",
+            "entry": [{"id": "0", "changes": [{"field": "messages", "value": {"messages": list(messages)}}]}]}
+
+def text(sender="4917612345", body="hi", ts="1700000000", **extra):
+    return {"from": sender, "id": "wamid.x", "timestamp": ts, "type": "text", "text": {"body": body}, **extra}
+
+def test_signature_is_checked_against_the_secret():
+    body = b'{"entry": []}'
+    sig = "sha256=" + hmac.new(b"s3cret", body, hashlib.sha256).hexdigest()
+    assert webhook.valid_signature(body, sig, secret="s3cret")
+    assert not webhook.valid_signature(body + b" ", sig, secret="s3cret")
+    assert not webhook.valid_signature(body, None, secret="s3cret")
+    assert not webhook.valid_signature(body, sig, secret="other")
+
+def test_unsigned_posts_need_an_explicit_opt_in():
+    assert not webhook.valid_signature(b"{}", None, secret="")
+    assert webhook.valid_signature(b"{}", None, secret="", insecure=True)
+    assert webhook.valid_signature(b"{}", None, secret="s3cret", insecure=True) is False
+
+def test_parse_flattens_messages():
+    rows = webhook.parse(payload(text(), {"from": "4915200000", "type": "image", "timestamp": "1700000060"}))
+    assert rows == [
+        {"sender": "+4917612345", "text": "hi", "status": "received", "timestamp": datetime.datetime(2023, 11, 14, 22, 13, 20)},
+        {"sender": "+4915200000", "text": "[image]", "status": "received", "timestamp": datetime.datetime(2023, 11, 14, 22, 14, 20)}]
+
+def test_parse_ignores_status_callbacks():
+    assert webhook.parse({"entry": [{"changes": [{"value": {"statuses": [{"status": "read"}]}}]}]}) == []
+
+def test_parse_skips_malformed_messages():
+    bad = [text(body={"x": 1}), text(body=5), text(sender=4917612345), text(sender=None),
+           text(sender="<img src=x>"), text(type=["text"])]
+    assert webhook.parse(payload(*bad, text(body="ok"))) == webhook.parse(payload(text(body="ok")))
+
+def test_parse_replaces_unusable_timestamps_with_now():
+    before = datetime.datetime.utcnow()
+    for ts in ("99999999999999999999", "-1e30", "soon", None, {"t": 1}):
+        (row,) = webhook.parse(payload(text(ts=ts)))
+        assert before <= row["timestamp"] <= datetime.datetime.utcnow()
+
+def test_write_batch_upserts_users_and_counters(db):
+    t0 = datetime.datetime(2026, 1, 1, 12)
+    db.add(User(phone="+1", first_seen=t0, last_seen=t0, message_count=3)); db.commit()
+    rows = [{"sender": s, "text": "x", "status": "received", "timestamp": t0 + datetime.timedelta(minutes=m)}
+            for s, m in (("+1", 5), ("+2", 1), ("+1", 2))]
+    written, users = webhook.write_batch(rows)
+    assert [r["id"] for r in written] == sorted(r["id"] for r in written) and len(written) == 3
+    by_phone = {u.phone: u for u in users}
+    assert by_phone["+1"].message_count == 5 and by_phone["+1"].last_seen == t0 + datetime.timedelta(minutes=5)
+    assert by_phone["+1"].first_seen == t0 and by_phone["+2"].message_count == 1
+    assert stats.read(db) == {**stats.count_all(db)} == {"total": 3, "received": 3, "sent": 0, "failed": 0, "users": 2}
+    assert activity.series(db, t0, t0 + datetime.timedelta(hours=1))[0]["count"] == 3
+
+def run_ingestor(write, batches):
+    stored = []
+    async def go():
+        async def on_batch(rows, users): stored.extend(rows)
+        ing = webhook.Ingestor(on_batch=on_batch, write=write, flush_ms=1)
+        ing.start()
+        for rows in batches: assert await ing.submit(rows)
+        await ing.stop()
+    asyncio.run(go())
+    return stored
+
+def test_a_bad_row_is_dropped_without_blocking_the_rest(db):
+    ok = lambda n: {"sender": "+1", "text": f"ok {n}", "status": "received", "timestamp": datetime.datetime.utcnow()}
+    bad = {**ok(0), "text": {"x": 1}}
+    stored = run_ingestor(webhook.write_batch, [[ok(1), ok(2), bad, ok(3)], [ok(4)]])
+    assert sorted(r["text"] for r in stored) == ["ok 1", "ok 2", "ok 3", "ok 4"]
+    assert db.query(Message).count() == 4 and stats.read(db)["total"] == 4
+
+def test_transient_errors_are_retried():
+    calls = []
+    def flaky(rows):
+        calls.append(len(rows))
+        if len(calls) < 3: raise OperationalError("INSERT", {}, Exception("database is locked"))
+        return rows, []
+    assert len(run_ingestor(flaky, [[{"sender": "+1"}, {"sender": "+2"}]])) == 2
+    assert calls == [2, 2, 2]